@@ -0,0 +1,189 @@
+"""
+A minimal stand-in for racetime.gg, for exercising RandoBot offline.
+
+Implements just enough of the site for racetime_bot: the OAuth2 token
+endpoint, category and race data endpoints, and bot websockets for each
+race room. Tests drive rooms by injecting chat messages with `say`, and can
+wait for the bot's next action in a room with `next_action`.
+"""
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+
+from aiohttp import WSMsgType, web
+
+
+class FakeRoom:
+    """
+    A race room on the fake server.
+    """
+    def __init__(self, category, slug, goal='Standard Flags', status='open'):
+        self.name = '%s/%s' % (category, slug)
+        self.slug = slug
+        self.goal = goal
+        self.status = status
+        self.info_user = ''
+        self.sockets = []
+        self.actions = asyncio.Queue()
+        self.connected = asyncio.Event()
+
+    def data(self):
+        return {
+            'name': self.name,
+            'slug': self.slug,
+            'status': {'value': self.status},
+            'goal': {'name': self.goal, 'custom': self.goal not in ('Standard Flags', 'Tournament')},
+            'info_user': self.info_user,
+            'info_bot': '',
+            'data_url': '/%s/data' % self.name,
+            'websocket_bot_url': '/ws/o/bot/%s' % self.slug,
+            'opened_at': '2026-01-01T00:00:00.000Z',
+            'entrants': [],
+        }
+
+
+class FakeRacetime:
+    """
+    Fake racetime.gg server. Rooms are opened in `category` unless another
+    one is given. HTTP requests take `latency` seconds to answer, to stand in
+    for the round trip to the real site.
+    """
+    def __init__(self, category='dwr', host='127.0.0.1', port=0, latency=0):
+        self.category = category
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.rooms = {}
+        self.actions_received = 0
+        self.token_requests = 0
+        self.list_requests = 0
+        self.list_not_modified = 0
+        self.runner = None
+
+        self.app = web.Application(middlewares=[self.delay])
+        self.app.router.add_post('/o/token', self.token)
+        self.app.router.add_get('/{category}/data', self.category_data)
+        self.app.router.add_get('/{category}/{slug}/data', self.race_data)
+        self.app.router.add_get('/ws/o/bot/{slug}', self.bot_socket)
+
+    @web.middleware
+    async def delay(self, request, handler):
+        if self.latency and not request.path.startswith('/ws/'):
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    @property
+    def address(self):
+        return '%s:%d' % (self.host, self.port)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for room in self.rooms.values():
+            for ws in list(room.sockets):
+                await ws.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+    def open_room(self, slug, goal='Standard Flags', category=None):
+        room = FakeRoom(category or self.category, slug, goal=goal)
+        self.rooms[slug] = room
+        return room
+
+    async def token(self, request):
+        self.token_requests += 1
+        return web.json_response({
+            'access_token': uuid.uuid4().hex,
+            'expires_in': 36000,
+        })
+
+    async def category_data(self, request):
+        self.list_requests += 1
+        body = json.dumps({
+            'current_races': [
+                {
+                    'name': room.name,
+                    'status': {'value': room.status},
+                    'data_url': '/%s/data' % room.name,
+                }
+                for room in self.rooms.values()
+                if room.name.startswith(request.match_info['category'] + '/')
+            ],
+        })
+        etag = '"%s"' % hashlib.md5(body.encode()).hexdigest()
+        if request.headers.get('If-None-Match') == etag:
+            self.list_not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(
+            text=body,
+            content_type='application/json',
+            headers={'ETag': etag},
+        )
+
+    async def race_data(self, request):
+        room = self.rooms.get(request.match_info['slug'])
+        if not room:
+            raise web.HTTPNotFound()
+        return web.json_response(room.data())
+
+    async def bot_socket(self, request):
+        room = self.rooms.get(request.match_info['slug'])
+        if not room:
+            raise web.HTTPNotFound()
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        room.sockets.append(ws)
+        room.connected.set()
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                action = json.loads(msg.data)
+                self.actions_received += 1
+                if action.get('action') == 'setinfo':
+                    room.info_user = action['data'].get('info_user', room.info_user)
+                room.actions.put_nowait((time.perf_counter(), action))
+        finally:
+            room.sockets.remove(ws)
+        return ws
+
+    async def send(self, room, payload):
+        for ws in room.sockets:
+            await ws.send_str(json.dumps(payload))
+
+    async def say(self, room, text, user='runner', monitor=False):
+        """
+        Send a chat message into a room, as if typed by a user.
+        """
+        await self.send(room, {
+            'type': 'chat.message',
+            'message': {
+                'id': uuid.uuid4().hex,
+                'user': {'name': user, 'can_moderate': False},
+                'message': text,
+                'is_bot': False,
+                'is_system': False,
+                'is_monitor': monitor,
+            },
+        })
+
+    async def set_status(self, room, status):
+        room.status = status
+        await self.send(room, {'type': 'race.data', 'race': room.data()})
+
+    async def next_action(self, room, timeout):
+        """
+        Wait for the bot's next action in a room. Returns a (timestamp,
+        action) tuple, or None on timeout.
+        """
+        try:
+            return await asyncio.wait_for(room.actions.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
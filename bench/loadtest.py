@@ -0,0 +1,170 @@
+"""
+Load test RandoBot against a local fake racetime.gg server.
+
+Opens a number of simulated race rooms, starts the bot in a subprocess
+pointed at the fake server, replays a scripted mix of commands in every room
+at once and reports command-to-reply latency, bot message throughput and the
+bot's peak RSS. Runs entirely offline.
+
+    python bench/loadtest.py --rooms 200 --rounds 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import signal
+import statistics
+import sys
+import time
+
+from fake_racetime import FakeRacetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Command scripts, by room goal. Each round replays one script in full.
+SCRIPTS = {
+    'Standard Flags': [
+        ['!roll', '!clear'],
+        ['!summer', '!version v3.0.3', '!clear'],
+        ['!dwflags IVIAAVCEKACAAAAAAAAAAEAQ', '!url', '!clear'],
+    ],
+    'Custom': [
+        ['!juef IVKEAVAUKACBIQAACAAAAEIUAAQBAAAAABYKCAAA', '!clear'],
+        ['!week3', '!clear'],
+        ['!week8b', '!version v3.0.3', '!clear'],
+    ],
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+async def drain(server, room, quiet_for):
+    """
+    Discard bot actions in a room until it has been quiet for a while.
+    """
+    while await server.next_action(room, quiet_for):
+        pass
+
+
+async def run_room(server, room, args, latencies, timeouts):
+    rng = random.Random(room.name)
+    await drain(server, room, 0.5)
+    for _ in range(args.rounds):
+        for command in rng.choice(SCRIPTS[room.goal]):
+            sent_at = time.perf_counter()
+            # Different entrants type each command, as in a real room.
+            await server.say(room, command, user='runner%d' % rng.randrange(8))
+            reply = await server.next_action(room, args.timeout)
+            if reply is None:
+                timeouts.append(command)
+                continue
+            latencies.setdefault(command.split(' ')[0], []).append(reply[0] - sent_at)
+            # Let the rest of this command's output arrive before moving on.
+            await drain(server, room, args.settle)
+
+
+async def main(args):
+    server = FakeRacetime(category=args.category)
+    await server.start()
+    goals = list(SCRIPTS)
+    rooms = [
+        server.open_room('room-%04d' % i, goal=goals[i % len(goals)])
+        for i in range(args.rooms)
+    ]
+
+    bot_args = [
+        sys.executable, '-c', 'from randobot import main; main()',
+        args.category, 'client-id', 'client-secret',
+        '--host', server.address, '--insecure',
+    ] + args.bot_args
+    started = time.perf_counter()
+    bot = await asyncio.create_subprocess_exec(
+        *bot_args,
+        cwd=REPO_ROOT,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=None if args.show_bot_output else asyncio.subprocess.DEVNULL,
+    )
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(room.connected.wait() for room in rooms)),
+            args.join_timeout,
+        )
+    except asyncio.TimeoutError:
+        joined = sum(room.connected.is_set() for room in rooms)
+        print('Bot only joined %d of %d rooms.' % (joined, len(rooms)), file=sys.stderr)
+    joined_in = time.perf_counter() - started
+
+    latencies = {}
+    timeouts = []
+    actions_before = server.actions_received
+    replay_started = time.perf_counter()
+    await asyncio.gather(*(
+        run_room(server, room, args, latencies, timeouts)
+        for room in rooms if room.connected.is_set()
+    ))
+    duration = time.perf_counter() - replay_started
+    actions = server.actions_received - actions_before
+
+    bot.send_signal(signal.SIGTERM)
+    await bot.wait()
+    await server.stop()
+
+    everything = [value for values in latencies.values() for value in values]
+    report = {
+        'rooms': args.rooms,
+        'rounds': args.rounds,
+        'join_seconds': round(joined_in, 3),
+        'commands': len(everything),
+        'timeouts': len(timeouts),
+        'p50_ms': round(percentile(everything, 50) * 1000, 2),
+        'p99_ms': round(percentile(everything, 99) * 1000, 2),
+        'mean_ms': round(statistics.mean(everything) * 1000, 2) if everything else 0.0,
+        'bot_actions': actions,
+        'actions_per_second': round(actions / duration, 1) if duration else 0.0,
+        'bot_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'by_command': {
+            command: {
+                'count': len(values),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+            }
+            for command, values in sorted(latencies.items())
+        },
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            if key != 'by_command':
+                print('%-20s %s' % (key, value))
+        for command, stats in report['by_command'].items():
+            print('  %-12s n=%-6d p50=%8.2fms p99=%8.2fms' % (
+                command, stats['count'], stats['p50_ms'], stats['p99_ms'],
+            ))
+    return 1 if timeouts else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=50, help='simulated race rooms')
+    parser.add_argument('--rounds', type=int, default=3, help='scripts replayed per room')
+    parser.add_argument('--category', type=str, default='dwr')
+    parser.add_argument('--timeout', type=float, default=10, help='seconds to wait for a reply')
+    parser.add_argument('--settle', type=float, default=0.2, help='seconds of quiet that end a reply')
+    parser.add_argument('--join-timeout', type=float, default=60, help='seconds to wait for the bot to join every room')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--show-bot-output', action='store_true', help='show the bot\'s log output')
+    parser.add_argument('bot_args', nargs=argparse.REMAINDER, help='extra arguments for randobot (after --)')
+    args = parser.parse_args()
+    if args.bot_args[:1] == ['--']:
+        args.bot_args = args.bot_args[1:]
+    sys.exit(asyncio.run(main(args)))
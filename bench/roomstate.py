@@ -0,0 +1,134 @@
+"""
+Measure the memory RandoBot keeps per race room.
+
+Compares the old representation (a free-form state dict plus the full
+race.data payload) with the current one (a slotted RoomState plus trimmed
+race data), for rooms with a given number of entrants. Runs offline.
+
+    python bench/roomstate.py --rooms 1000 --entrants 8
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from randobot.state import RoomState, trim_race_data  # noqa: E402
+
+
+def race_payload(index, entrants):
+    """
+    Build a race.data payload shaped like racetime.gg's.
+    """
+    slug = 'clever-slime-%04d' % index
+    return json.loads(json.dumps({
+        'version': 12,
+        'name': 'dwr/' + slug,
+        'slug': slug,
+        'status': {'value': 'open', 'verbose_value': 'Open', 'help_text': 'Anyone may join this race'},
+        'url': '/dwr/' + slug,
+        'data_url': '/dwr/%s/data' % slug,
+        'websocket_url': '/ws/race/' + slug,
+        'websocket_bot_url': '/ws/o/bot/' + slug,
+        'websocket_oauth_url': '/ws/o/race/' + slug,
+        'category': {
+            'name': 'Dragon Warrior Randomizer', 'short_name': 'DWR', 'slug': 'dwr',
+            'url': '/dwr', 'data_url': '/dwr/data', 'image': '/media/dwr.png',
+        },
+        'goal': {'name': 'Standard Flags', 'custom': False},
+        'info': '', 'info_bot': '', 'info_user': '',
+        'entrants_count': entrants, 'entrants_count_finished': 0,
+        'entrants_count_inactive': 0,
+        'entrants': [
+            {
+                'user': {
+                    'id': 'user%04d%02d' % (index, n),
+                    'full_name': 'Runner%d#%04d' % (n, index),
+                    'name': 'Runner%d' % n,
+                    'discriminator': '%04d' % index,
+                    'url': '/user/user%04d%02d' % (index, n),
+                    'avatar': None, 'pronouns': None, 'flair': '',
+                    'twitch_name': 'runner%d' % n,
+                    'twitch_display_name': 'Runner%d' % n,
+                    'twitch_channel': 'https://www.twitch.tv/runner%d' % n,
+                    'can_moderate': False,
+                },
+                'status': {'value': 'not_ready', 'verbose_value': 'Not ready', 'help_text': 'Not ready to begin'},
+                'finish_time': None, 'finished_at': None, 'place': None,
+                'place_ordinal': None, 'score': 1500, 'score_change': None,
+                'comment': None, 'has_comment': False, 'stream_live': False,
+                'stream_override': False,
+            }
+            for n in range(entrants)
+        ],
+        'opened_at': '2026-01-01T00:00:00.000Z', 'start_delay': 'P0DT00H00M15S',
+        'started_at': None, 'ended_at': None, 'cancelled_at': None,
+        'unlisted': False, 'time_limit': 'P1DT00H00M00S', 'streaming_required': False,
+        'auto_start': True, 'opened_by': None, 'monitors': [], 'recordable': True,
+        'recorded': False, 'recorded_by': None, 'allow_comments': True,
+        'hide_comments': False, 'allow_midrace_chat': True,
+        'allow_non_entrant_chat': True, 'chat_message_delay': 0,
+    }))
+
+
+def old_state():
+    return {
+        'intro_sent': True,
+        'locked': False,
+        'seed_rolled': True,
+        'build_type': 'release',
+        'race_version': 'v3.0.3',
+        'race_flagstring': 'IVIAAVCEKACAAAAAAAAAAEAQ',
+        'race_seed': 4818302755721,
+        'race_url': '',
+        'reroll': 1,
+    }
+
+
+def measure(rooms, build):
+    """
+    Return the bytes allocated per room by build(index).
+    """
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [build(index) for index in range(rooms)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del kept
+    return allocated / rooms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--entrants', type=int, default=8, help='entrants per race')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    def before(index):
+        return old_state(), race_payload(index, args.entrants)
+
+    def after(index):
+        data = trim_race_data(race_payload(index, args.entrants))
+        state = RoomState.from_dict(old_state())
+        state.update_race(data)
+        return state, data
+
+    report = {
+        'rooms': args.rooms,
+        'entrants': args.entrants,
+        'bytes_per_room_before': round(measure(args.rooms, before)),
+        'bytes_per_room_after': round(measure(args.rooms, after)),
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print('%-24s %s' % (key, value))
+
+
+if __name__ == '__main__':
+    main()
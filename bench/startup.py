@@ -0,0 +1,97 @@
+"""
+Measure how quickly RandoBot starts serving race rooms after a restart.
+
+Opens a number of race rooms on a local fake racetime.gg server (with a
+simulated network round trip on every HTTP request), starts the bot, and
+sends a command in each room as soon as the bot connects to it. Reports the
+time from process start until the first and last room were joined and
+answered. Runs entirely offline.
+
+    python bench/startup.py --rooms 50 --latency 0.1
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from fake_racetime import FakeRacetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMAND = '!flags IVIAAVCEKACAAAAAAAAAAEAQ'
+
+
+async def serve_room(server, room, started, args):
+    """
+    Return (joined, answered) seconds since process start for a room.
+    """
+    await room.connected.wait()
+    joined = time.perf_counter() - started
+    await server.say(room, COMMAND)
+    while True:
+        action = await server.next_action(room, args.timeout)
+        if action is None:
+            return joined, None
+        if 'IVIAAVCEKACAAAAAAAAAAEAQ' in action[1]['data'].get('message', ''):
+            return joined, action[0] - started
+
+
+async def main(args):
+    server = FakeRacetime(category=args.category, latency=args.latency)
+    await server.start()
+    rooms = [server.open_room('room-%04d' % i) for i in range(args.rooms)]
+
+    started = time.perf_counter()
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable, '-c', 'from randobot import main; main()',
+        args.category, 'client-id', 'client-secret',
+        '--host', server.address, '--insecure',
+        *args.bot_args,
+        cwd=REPO_ROOT,
+        stdout=None if args.show_bot_output else asyncio.subprocess.DEVNULL,
+        stderr=None if args.show_bot_output else asyncio.subprocess.DEVNULL,
+    )
+    try:
+        results = await asyncio.wait_for(
+            asyncio.gather(*(serve_room(server, room, started, args) for room in rooms)),
+            args.timeout * 2,
+        )
+    finally:
+        bot.terminate()
+        await bot.wait()
+        await server.stop()
+
+    joined = sorted(result[0] for result in results)
+    answered = sorted(result[1] for result in results if result[1] is not None)
+    report = {
+        'rooms': args.rooms,
+        'latency_ms': round(args.latency * 1000),
+        'first_joined_s': round(joined[0], 3),
+        'all_joined_s': round(joined[-1], 3),
+        'first_answered_s': round(answered[0], 3) if answered else None,
+        'all_answered_s': round(answered[-1], 3) if answered else None,
+        'unanswered': len(results) - len(answered),
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print('%-20s %s' % (key, value))
+    return 1 if report['unanswered'] else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=50, help='race rooms open when the bot starts')
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds each HTTP request takes (default: 0.1)')
+    parser.add_argument('--category', type=str, default='dwr')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a reply')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--show-bot-output', action='store_true', help='show the bot\'s log output')
+    parser.add_argument('bot_args', nargs=argparse.REMAINDER, help='extra arguments for randobot (after --)')
+    args = parser.parse_args()
+    if args.bot_args[:1] == ['--']:
+        args.bot_args = args.bot_args[1:]
+    sys.exit(asyncio.run(main(args)))
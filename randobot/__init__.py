@@ -1,47 +1,132 @@
 import argparse
-import logging
+import json
+import os
 import sys
+import time
 
-from .bot import RandoBot
+# When the process started loading the bot (before the slow imports below),
+# for the startup timing log.
+STARTED = time.perf_counter()
+
+from .bot import RandoBot, run_bots  # noqa: E402
+from .logs import configure_logging  # noqa: E402
+from .shared import SharedResources  # noqa: E402
 
 
 def main():
+    if sys.argv[1:2] == ['bulk']:
+        from . import bulk
+        sys.exit(bulk.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['replay']:
+        from . import replay
+        sys.exit(replay.main(sys.argv[2:]))
+
     parser = argparse.ArgumentParser(
         description='RandoBot, because OoTR seeds weren\'t scary enough already.',
     )
-    parser.add_argument('category_slug', type=str, help='racetime.gg category')
-    parser.add_argument('client_id', type=str, help='racetime.gg client ID')
-    parser.add_argument('client_secret', type=str, help='racetime.gg client secret')
+    parser.add_argument('category_slug', type=str, nargs='?', help='racetime.gg category')
+    parser.add_argument('client_id', type=str, nargs='?', help='racetime.gg client ID')
+    parser.add_argument('client_secret', type=str, nargs='?', help='racetime.gg client secret')
+    parser.add_argument('--categories', type=str, help='JSON file listing further categories to serve from this process')
+    parser.add_argument('--commands', type=str, help='command registry JSON file (reloaded on SIGHUP)')
+    parser.add_argument('--schedule', type=str, help='JSON file of seeds to roll automatically in matching race rooms (reloaded on SIGHUP)')
+    parser.add_argument('--state-db', type=str, help='SQLite file to keep race room state in across restarts')
+    parser.add_argument('--ootr-api-key', type=str, help='ootrandomizer.com API key, enables scheduled OoTR preset rolls')
+    parser.add_argument('--preset-ttl', type=int, help='seconds before the OoTR preset list is revalidated')
+    parser.add_argument('--preset-cache', type=str, help='file to keep the last good OoTR preset list in')
+    parser.add_argument('--seed-pool', type=str, action='append', default=[], metavar='PRESET[:spoiler]', help='keep pre-rolled OoTR seeds ready for this preset (repeatable)')
+    parser.add_argument('--seed-pool-size', type=int, help='pre-rolled seeds to keep per preset')
+    parser.add_argument('--versions-url', type=str, help='URL to keep the randomizer version catalog up to date from')
+    parser.add_argument('--versions-cache', type=str, help='file to keep the last good version catalog in')
+    parser.add_argument('--seed-secret', type=str, default=os.environ.get('RANDOBOT_SEED_SECRET'), help='derive DWR seeds from this secret so they can be verified (default: $RANDOBOT_SEED_SECRET)')
+    parser.add_argument('--max-rooms', type=int, help='most race rooms to handle at once (per worker, with --workers)')
+    parser.add_argument('--record', type=str, metavar='DIR', help='record race room traffic to this directory, for randobot replay')
+    parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics at /metrics on this port')
+    parser.add_argument('--metrics-host', type=str, default='127.0.0.1', help='address to serve metrics on (default: 127.0.0.1)')
+    parser.add_argument('--admin-port', type=int, help='serve the admin API on 127.0.0.1 on this port')
+    parser.add_argument('--admin-socket', type=str, help='serve the admin API on this Unix socket')
+    parser.add_argument('--workers', type=int, help='run this many worker processes, sharing race rooms between them')
     parser.add_argument('--verbose', '-v', action='store_true', help='verbose output')
+    parser.add_argument('--log-json', action='store_true', help='write logs as JSON lines, tagged with race and command')
+    parser.add_argument('--log-sample-rate', type=float, help='log at most this many websocket frames, chat messages etc. per second of each kind')
     parser.add_argument('--host', type=str, nargs='?', help='change the ractime.gg host (debug only!')
     parser.add_argument('--insecure', action='store_true', help='don\'t use HTTPS (debug only!)')
 
     args = parser.parse_args()
 
-    logger = logging.getLogger()
-    handler = logging.StreamHandler(sys.stdout)
-
-    if args.verbose:
-        logger.setLevel(logging.DEBUG)
-        handler.setLevel(logging.DEBUG)
+    categories = []
+    if args.category_slug:
+        if not args.client_secret:
+            parser.error('category_slug needs a client_id and client_secret')
+        categories.append({
+            'category_slug': args.category_slug,
+            'client_id': args.client_id,
+            'client_secret': args.client_secret,
+            'commands': args.commands,
+        })
+    if args.categories:
+        with open(args.categories, 'r', encoding='utf-8') as f:
+            categories.extend(json.load(f))
+    if not categories:
+        parser.error('give a category_slug, client_id and client_secret, or --categories')
 
-    handler.setFormatter(logging.Formatter(
-        '[%(asctime)s] %(name)s (%(levelname)s) :: %(message)s'
-    ))
-    logger.addHandler(handler)
+    logging_kwargs = dict(
+        verbose=args.verbose,
+        json_format=args.log_json,
+        sample_rate=args.log_sample_rate,
+    )
+    logger = configure_logging(**logging_kwargs)
 
     if args.host:
         RandoBot.racetime_host = args.host
     if args.insecure:
         RandoBot.racetime_secure = False
 
-    inst = RandoBot(
-        category_slug=args.category_slug,
-        client_id=args.client_id,
-        client_secret=args.client_secret,
-        logger=logger,
+    shared_kwargs = dict(
+        state_path=args.state_db,
+        ootr_api_key=args.ootr_api_key,
+        preset_ttl=args.preset_ttl,
+        preset_snapshot=args.preset_cache,
+        seed_pool=[
+            (preset, mode != 'spoiler')
+            for preset, _, mode in (target.partition(':') for target in args.seed_pool)
+        ],
+        seed_pool_size=args.seed_pool_size,
+        seed_secret=args.seed_secret,
+        max_rooms=args.max_rooms,
+        versions_url=args.versions_url,
+        versions_cache=args.versions_cache,
+        schedule_path=args.schedule,
+        record_dir=args.record,
+        metrics_host=args.metrics_host,
+        metrics_port=args.metrics_port,
+        admin_port=args.admin_port,
+        admin_socket=args.admin_socket,
     )
-    inst.run()
+
+    if args.workers:
+        from .shard import Supervisor
+        Supervisor(
+            workers=args.workers,
+            categories=categories,
+            shared_kwargs=shared_kwargs,
+            logger=logger,
+            logging_kwargs=logging_kwargs,
+        ).run()
+        return
+
+    shared = SharedResources(logger=logger, **shared_kwargs)
+    run_bots([
+        RandoBot(
+            commands_path=category.get('commands'),
+            shared=shared,
+            category_slug=category['category_slug'],
+            client_id=category['client_id'],
+            client_secret=category['client_secret'],
+            logger=logger,
+        )
+        for category in categories
+    ])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,204 @@
+import asyncio
+import json
+from fnmatch import fnmatchcase
+
+from .handler import RandoHandler
+from .state import Goal, Status
+
+
+def parse_filter(enum, value, other=None):
+    """
+    Parse a comma separated list of enum members, by name or value (e.g.
+    "standard_flags,Tournament"), into a set. Empty means no filter.
+
+    Items that aren't members are added to the `other` set, if one is
+    given, and are an error otherwise.
+    """
+    if not value:
+        return None
+    members = set()
+    for item in value.split(','):
+        item = item.strip()
+        if item.upper() in enum.__members__:
+            members.add(enum[item.upper()])
+        elif item in {member.value for member in enum}:
+            members.add(enum(item))
+        elif other is not None:
+            other.add(item)
+        else:
+            raise ValueError('Unknown %s "%s".' % (enum.__name__.lower(), item))
+    return members
+
+
+FILTERS = ('goal', 'status', 'race')
+
+
+class AdminServer:
+    """
+    Local admin API over the race rooms every bot in the process tracks.
+
+    Serves only on localhost or a Unix socket, as there is no
+    authentication:
+
+    * GET /rooms - one JSON line per room with its seed, flags, version,
+      build type, lock and seed URL, read straight from the bots' room
+      state. Filter with `goal` (comma separated Goal names or values, e.g.
+      "custom" for every custom goal, or goal names as shown on racetime.gg),
+      `status` (comma separated Status names or values) and `race` (a
+      pattern the room name must match).
+    * POST /rooms/lock, /rooms/unlock, /rooms/clear - run the action in
+      every matching room the bot is connected to, through the room's
+      handler, as if a race monitor had sent the command. Takes the same
+      filters, and answers with the rooms acted on, those where the action
+      failed, those left alone because their race is in progress (unlock
+      and clear only) and those skipped (not connected).
+    """
+    def __init__(self, shared, port=None, path=None):
+        self.shared = shared
+        self.port = port
+        self.path = path
+        self._runner = None
+
+    def rooms(self, query):
+        """
+        Yield (bot, name, state) for every tracked room matching a request's
+        filters. Raises ValueError for an invalid filter.
+        """
+        for key in FILTERS:
+            if query.get(key) is not None and not isinstance(query[key], str):
+                raise ValueError('Filter "%s" must be a string.' % key)
+        goal_names = set()
+        goals = parse_filter(Goal, query.get('goal'), other=goal_names)
+        goal_names = {name.casefold() for name in goal_names}
+        statuses = parse_filter(Status, query.get('status'))
+        pattern = query.get('race') or '*'
+        for bot in self.shared.bots:
+            for name, state in list(bot.state.items()):
+                if (
+                    fnmatchcase(name, pattern)
+                    and (
+                        goals is None
+                        or state.goal in goals
+                        or (state.goal_name or '').casefold() in goal_names
+                    )
+                    and (statuses is None or state.status in statuses)
+                ):
+                    yield bot, name, state
+
+    @staticmethod
+    def room_info(bot, name, state):
+        url = state.race_url
+        if state.seed_rolled and not url:
+            url = bot.catalog.seed_url(
+                state.race_version,
+                state.build_type,
+                state.race_flagstring,
+                state.race_seed,
+            )
+        return {
+            'race': name,
+            'goal': state.goal_name,
+            'status': state.status.value,
+            'handled': name in bot.rooms,
+            'seed_rolled': state.seed_rolled,
+            'race_seed': state.race_seed,
+            'race_flagstring': state.race_flagstring,
+            'race_version': state.race_version,
+            'build_type': state.build_type,
+            'locked': state.locked,
+            'url': url or None,
+        }
+
+    async def handle_rooms(self, request):
+        from aiohttp import web
+
+        try:
+            rooms = list(self.rooms(request.query))
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        response = web.StreamResponse(headers={
+            'Content-Type': 'application/x-ndjson; charset=utf-8',
+        })
+        await response.prepare(request)
+        for room in rooms:
+            await response.write(
+                (json.dumps(self.room_info(*room)) + '\n').encode('utf-8')
+            )
+        await response.write_eof()
+        return response
+
+    async def handle_action(self, request):
+        from aiohttp import web
+
+        action = request.match_info['action']
+        if action not in RandoHandler.admin_actions:
+            raise web.HTTPNotFound()
+        query = dict(request.query)
+        if request.can_read_body:
+            try:
+                body = await request.json()
+            except ValueError:
+                body = None
+            if not isinstance(body, dict):
+                raise web.HTTPBadRequest(text='Body must be a JSON object.')
+            query.update(body)
+        try:
+            rooms = list(self.rooms(query))
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+        names, skipped, tasks = [], [], []
+        for bot, name, _ in rooms:
+            handler = bot.rooms.get(name)
+            if handler is None:
+                skipped.append(name)
+                continue
+            names.append(name)
+            tasks.append(handler.submit_admin_action(action))
+        self.shared.logger.info(
+            'Admin API: %(action)s in %(count)d rooms.'
+            % {'action': action, 'count': len(names)}
+        )
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        done, failed, in_progress = [], [], []
+        for name, result in zip(names, results):
+            if result == 'skipped':
+                in_progress.append(name)
+            elif result == 'done':
+                done.append(name)
+            else:
+                failed.append(name)
+        if failed:
+            self.shared.logger.warning(
+                'Admin API: %(action)s failed in %(count)d rooms: %(rooms)s'
+                % {'action': action, 'count': len(failed), 'rooms': ', '.join(failed)}
+            )
+        return web.json_response({
+            'action': action,
+            'rooms': done,
+            'failed': failed,
+            'in_progress': in_progress,
+            'skipped': skipped,
+        })
+
+    async def serve(self):
+        """
+        Serve the admin API on 127.0.0.1:`port` and/or the Unix socket at
+        `path`.
+        """
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/rooms', self.handle_rooms)
+        app.router.add_post('/rooms/{action}', self.handle_action)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        if self.port:
+            await web.TCPSite(self._runner, '127.0.0.1', self.port).start()
+        if self.path:
+            await web.UnixSite(self._runner, self.path).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -1,19 +1,460 @@
+import asyncio
+import collections
+import hashlib
+import json
+import signal
+import time
+
+import aiohttp
 from racetime_bot import Bot
 
 from .handler import RandoHandler
+from .registry import CommandRegistry
+from .shared import SharedResources
+from .state import RoomState
 
 
 class RandoBot(Bot):
     """
     RandoBot base class.
+
+    Each instance serves one racetime.gg category. Several instances can run
+    in the same process (see `run_bots`), sharing one event loop and one set
+    of SharedResources.
     """
-    def __init__(self, *args, **kwargs):
+    # Whether the bot polls its category's race list itself (see
+    # refresh_races).
+    polls_races = True
+
+    # Whether the bot joins race rooms itself, and so needs an access token.
+    needs_token = True
+
+    # Most race data requests to make at once while scanning for races.
+    scan_concurrency = 8
+
+    # Seconds between race list polls. Polling speeds up to
+    # scan_min_interval whenever the list changes, and slows down by
+    # scan_backoff each time it doesn't, up to scan_max_interval.
+    scan_min_interval = 5
+    scan_max_interval = 60
+    scan_backoff = 1.5
+
+    def __init__(self, *args, commands_path=None, shared=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.registry = CommandRegistry(commands_path)
+        self.shared = shared or SharedResources(self.logger)
+        self.catalog = self.shared.catalog
+        self.metrics = self.shared.metrics
+        self.store = self.shared.store
+        self.zsr = self.shared.zsr
+        self.recorder = self.shared.recorder
+        self.schedule = self.shared.schedule
+        self.seed_pool = self.shared.seed_pool
+        self.seed_secret = self.shared.seed_secret
+        self.watchdog = self.shared.watchdog
+
+        # Set once the bot has an access token and its rooms' stored state
+        # (see bootstrap), and so can join race rooms.
+        self.ready = asyncio.Event()
+        # Set once the first scan of the category's races is done.
+        self.scanned = asyncio.Event()
+        # Races found that should not be handled, by name, with the race
+        # list summary they were last seen with. They aren't looked at again
+        # unless their summary changes.
+        self.ignored = {}
+        # Race list polls, by result: changed, not_modified, unchanged,
+        # rescanned or error. Not modified and unchanged polls were skipped.
+        self.polls = collections.Counter()
+        self._list_etag = None
+        self._list_last_modified = None
+        self._list_digest = None
+        # Handlers of the rooms this bot is connected to, by race name.
+        self.rooms = {}
+        self.shared.register(self)
+
+    def authorize(self):
+        """
+        Bot.__init__ fetches a token here, blocking. RandoBot fetches it in
+        `bootstrap` instead, alongside everything else startup waits on.
+        """
+        return None, self.reauthorize_every
+
+    async def fetch_token(self):
+        """
+        Get an OAuth2 token from the authentication server.
+        """
+        async with aiohttp.request(
+            method='post',
+            url=self.http_uri('/o/token'),
+            data={
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'client_credentials',
+            },
+            raise_for_status=True,
+        ) as resp:
+            data = json.loads(await resp.read())
+        if not data.get('access_token'):
+            raise Exception('Unable to retrieve access token.')
+        self.access_token = data['access_token']
+        self.reauthorize_every = data.get('expires_in', 36000)
+
+    async def reauthorize(self):
+        """
+        Get a new access token before the current one expires, forever.
+        """
+        await self.ready.wait()
+        while True:
+            await asyncio.sleep(self.reauthorize_every / 2)
+            self.logger.info('Get new access token')
+            await self.fetch_token()
+
+    def restore(self, restored):
+        """
+        Restore the stored state of the category's race rooms, before any
+        handler is created.
+        """
+        if not self.store:
+            return
+        self.state.update(
+            (name, RoomState.from_dict(state))
+            for name, state in restored.items()
+        )
+        self.logger.info(
+            'Restored state for %(count)d %(category)s races.'
+            % {'count': len(restored), 'category': self.category_slug}
+        )
 
     def get_handler_class(self):
         return RandoHandler
 
+    def create_handler(self, race_data):
+        name = race_data.get('name')
+        if name not in self.state:
+            self.state[name] = RoomState()
+        return super().create_handler(race_data)
+
     def get_handler_kwargs(self, *args, **kwargs):
         return {
             **super().get_handler_kwargs(*args, **kwargs),
+            'catalog': self.catalog,
+            'metrics': self.metrics,
+            'recorder': self.recorder,
+            'registry': self.registry,
+            'schedule': self.schedule,
+            'seed_pool': self.seed_pool,
+            'seed_secret': self.seed_secret,
+            'store': self.store,
+            'watchdog': self.watchdog,
+            'zsr': self.zsr,
+        }
+
+    def should_handle(self, race_data):
+        if super().should_handle(race_data):
+            return True
+        if self.store:
+            self.store.delete(race_data.get('name'))
+        return False
+
+    def reload_commands(self):
+        """
+        Reload the command registry. Handlers share the registry object, so
+        every room picks up the change without reconnecting.
+        """
+        self.registry.reload(self.logger)
+
+    async def fetch_json(self, url):
+        """
+        Fetch and decode a JSON document from racetime.gg.
+        """
+        async with aiohttp.request(
+            method='get',
+            url=self.http_uri(url),
+            raise_for_status=True,
+        ) as resp:
+            return json.loads(await resp.read())
+
+    async def fetch_race_list(self):
+        """
+        Fetch the category's race list, as a dict of race name to summary.
+
+        Returns None if the list hasn't changed since the last fetch, along
+        with the reason: "not_modified" if the server said so in answer to
+        the validators from the last response, or "unchanged" if the body is
+        the same as last time, in which case it isn't parsed.
+        """
+        headers = {}
+        if self._list_etag:
+            headers['If-None-Match'] = self._list_etag
+        if self._list_last_modified:
+            headers['If-Modified-Since'] = self._list_last_modified
+        async with aiohttp.request(
+            method='get',
+            url=self.http_uri(f'/{self.category_slug}/data'),
+            headers=headers,
+        ) as resp:
+            if resp.status == 304:
+                return None, 'not_modified'
+            resp.raise_for_status()
+            body = await resp.read()
+            self._list_etag = resp.headers.get('ETag')
+            self._list_last_modified = resp.headers.get('Last-Modified')
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        if digest == self._list_digest:
+            return None, 'unchanged'
+        self._list_digest = digest
+        return {
+            race.get('name'): race
+            for race in json.loads(body).get('current_races', [])
+        }, 'changed'
+
+    def count_poll(self, result):
+        """
+        Record the result of a race list poll.
+        """
+        self.polls[result] += 1
+        self.metrics.race_list_polls.inc(category=self.category_slug, result=result)
+
+    async def scan_races(self):
+        """
+        Retrieve the category's current race list, and pass any race that
+        should be handled but currently isn't to `assign_race`. Returns False
+        if the poll was skipped.
+
+        Only new races, and races whose summary changed since they were
+        ignored, are looked at. If the list is unchanged and every race in it
+        is handled or ignored, there is nothing to do and the poll is
+        skipped. Otherwise (e.g. a race was skipped at capacity, or its
+        handler stopped) the previous list is scanned again.
+
+        Race data for new races is fetched up to `scan_concurrency` at a
+        time, and each race is joined as soon as its data arrives, so after
+        a restart every room is rejoined in a few round trips. The first scan
+        runs while the bot is still bootstrapping, and only joins rooms once
+        it is ready.
+        """
+        try:
+            races, result = await self.fetch_race_list()
+        except Exception:
+            self.count_poll('error')
+            self.logger.error('Fatal error when attempting to retrieve race data.', exc_info=True)
+            return False
+        if races is None:
+            if all(
+                name in self.handlers or name in self.ignored
+                for name in self.races
+            ):
+                self.count_poll(result)
+                self.logger.debug(
+                    'Race list %(result)s, %(skipped)d of %(polls)d polls skipped.'
+                    % {
+                        'result': result.replace('_', ' '),
+                        'skipped': self.polls['not_modified'] + self.polls['unchanged'],
+                        'polls': sum(self.polls.values()),
+                    }
+                )
+                return False
+            races = self.races
+            result = 'rescanned'
+        self.count_poll(result)
+        self.logger.info('Refresh races')
+        self.races = races
+        self.ignored = {
+            name: summary
+            for name, summary in self.ignored.items()
+            if races.get(name) == summary
+        }
+
+        semaphore = asyncio.Semaphore(self.scan_concurrency)
+        skipped = 0
+
+        async def fetch_race(name, summary_data):
+            nonlocal skipped
+            async with semaphore:
+                if self.shared.at_capacity():
+                    skipped += 1
+                    return
+                try:
+                    race_data = await self.fetch_json(summary_data.get('data_url'))
+                except Exception:
+                    self.logger.error('Fatal error when attempting to retrieve summary data.', exc_info=True)
+                    return
+            await self.ready.wait()
+            if name in self.handlers:
+                return
+            if self.shared.at_capacity():
+                skipped += 1
+            elif self.should_handle(race_data):
+                self.assign_race(race_data)
+            else:
+                self.ignored[name] = summary_data
+                if name in self.state:
+                    del self.state[name]
+                self.logger.info(
+                    'Ignoring %(race)s by configuration.'
+                    % {'race': race_data.get('name')}
+                )
+
+        await asyncio.gather(*(
+            fetch_race(name, summary_data)
+            for name, summary_data in self.races.items()
+            if name not in self.handlers and name not in self.ignored
+        ))
+        if skipped:
+            self.logger.warning(
+                'Not joining %(count)d races: already handling %(max)d rooms.'
+                % {'count': skipped, 'max': self.shared.max_rooms}
+            )
+        return True
+
+    async def refresh_races(self):
+        """
+        Scan for new races forever, often while the race list is changing
+        (or races are waiting to be joined) and less often while it isn't.
+        """
+        interval = self.scan_min_interval
+        while True:
+            if await self.scan_races():
+                interval = self.scan_min_interval
+            else:
+                interval = min(self.scan_max_interval, interval * self.scan_backoff)
+            self.scanned.set()
+            await asyncio.sleep(interval)
+
+    def assign_race(self, race_data):
+        """
+        Decide who handles a newly found race. By default, this bot does.
+        """
+        self.join_race(race_data)
+
+    def join_race(self, race_data):
+        """
+        Connect to a race room and start handling it. Returns the handler's
+        task.
+        """
+        name = race_data.get('name')
+        handler = self.create_handler(race_data)
+        task = self.loop.create_task(handler.handle())
+        self.handlers[name] = task
+        self.rooms[name] = handler
+        task.add_done_callback(lambda task: self.race_done(name, task))
+        return task
+
+    def race_done(self, name, task):
+        """
+        Called when a race room's handler finishes, for whatever reason.
+        """
+        if self.handlers.get(name) is task:
+            del self.handlers[name]
+            del self.rooms[name]
+            # Nothing more will happen in a finished room, so stop tracking it.
+            state = self.state.get(name)
+            if state is not None and state.status.is_over:
+                del self.state[name]
+
+    def start(self):
+        """
+        Schedule the bot's background tasks, without running the loop.
+        """
+        if self.needs_token:
+            self.loop.create_task(self.reauthorize())
+        self.loop.create_task(self.refresh_races())
+
+    def run(self):
+        run_bots([self])
+
+
+async def bootstrap(bots, shared):
+    """
+    Get everything the bots need before they can join race rooms, all at
+    once: an access token for each category, stored room state and the
+    version catalog snapshot. Returns the seconds each step took.
+    """
+    async def fetch_tokens():
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            bot.fetch_token() for bot in bots if bot.needs_token
+        ))
+        return time.perf_counter() - started
+
+    token_time, timings = await asyncio.gather(fetch_tokens(), shared.bootstrap())
+    for bot in bots:
+        bot.restore(shared.restored_for(bot))
+        bot.ready.set()
+    return {'token': token_time, **timings}
+
+
+async def log_first_scan(bots, started):
+    """
+    Log how long after process start every bot had scanned its races once.
+    """
+    await asyncio.gather(*(bot.scanned.wait() for bot in bots))
+    bots[0].logger.info(
+        'First race scan done %(elapsed).3fs after start, handling %(rooms)d rooms.'
+        % {
+            'elapsed': time.perf_counter() - started,
+            'rooms': sum(len(bot.handlers) for bot in bots),
+        }
+    )
+
+
+def run_bots(bots, ready=None, stop_signals=(signal.SIGINT, signal.SIGTERM)):
+    """
+    Run one or more bots (each for its own category) on a single event loop,
+    until one of `stop_signals` arrives. `ready` is called once the bots have
+    everything they need to join race rooms.
+
+    All of the bots must have been created with the same SharedResources.
+    """
+    from . import STARTED
+
+    loop = bots[0].loop
+    shared = bots[0].shared
+
+    def reload_commands():
+        for bot in bots:
+            bot.reload_commands()
+        if shared.schedule:
+            shared.schedule.reload(shared.logger)
+
+    if hasattr(signal, 'SIGHUP'):
+        loop.add_signal_handler(signal.SIGHUP, reload_commands)
+
+    setup_time = time.perf_counter() - STARTED
+    # Start polling straight away: scans only join rooms once bootstrap is
+    # done, but can fetch race data in the meantime.
+    for bot in bots:
+        bot.start()
+    timings = loop.run_until_complete(bootstrap(bots, shared))
+    shared.logger.info(
+        'Ready %(elapsed).3fs after start: imports and setup %(setup).3fs, '
+        'then token %(token).3fs, state %(state).3fs and catalog '
+        '%(catalog).3fs at once.'
+        % {
+            'elapsed': time.perf_counter() - STARTED,
+            'setup': setup_time,
+            **timings,
         }
+    )
+    shared.start(loop)
+    if ready:
+        ready()
+    scanning = [bot for bot in bots if bot.polls_races]
+    if scanning:
+        loop.create_task(log_first_scan(scanning, STARTED))
+    loop.set_exception_handler(bots[0].handle_exception)
+    # Stop the loop rather than being killed outright (SIGTERM is how Heroku
+    # restarts a dyno), so closing flushes saved room state to disk.
+    for signum in stop_signals:
+        loop.add_signal_handler(signum, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        # Stop the handlers (and everything else) first, so each room
+        # finishes up and records its final state before shared resources
+        # close.
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        shared.close(loop)
@@ -0,0 +1,297 @@
+"""
+Roll seeds for a whole bracket at once, without any race rooms.
+
+    randobot bulk matches.txt --command summer --output seeds.jsonl
+    randobot bulk matches.csv --preset weekly --ootr-api-key KEY --output seeds.csv
+
+The match list has one match per line (the first column, if it is a CSV
+file); blank lines and lines starting with "#" are skipped. Results are
+written as each seed is ready. If the output file already exists, matches
+that already have a seed in it are skipped, so an interrupted run can simply
+be started again.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import sys
+
+from .flags import FlagError, decode_flags, schema_for
+from .registry import CommandRegistry
+from .seeds import SEED_MAX, SEED_MIN, derive_seed
+from .versions import VersionCatalog
+from .zsr import ZSR, ZSRError
+
+FIELDS = ('match', 'version', 'build_type', 'flags', 'seed', 'preset', 'url', 'error')
+
+
+def read_matches(path):
+    """
+    Read match names from a file ("-" for stdin).
+    """
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8', newline='')
+    try:
+        for row in csv.reader(f):
+            if not row or not row[0].strip() or row[0].startswith('#'):
+                continue
+            yield row[0].strip()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+class ResultWriter:
+    """
+    Appends results to a JSONL or CSV file, one line per match, flushing
+    after every line.
+    """
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self.file = None
+        self.csv = None
+
+    def done(self):
+        """
+        Return the set of matches that already have a seed in the output
+        file.
+        """
+        if self.path == '-' or not os.path.exists(self.path):
+            return set()
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            # Leave out a partial last line, which open() will cut off.
+            text = f.read().rpartition('\n')
+            text = text[0] + text[1]
+        if self.fmt == 'csv':
+            rows = csv.DictReader(io.StringIO(text, newline=''))
+        else:
+            rows = []
+            for line in text.split('\n'):
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+        return {row['match'] for row in rows if not row.get('error')}
+
+    def trim(self):
+        """
+        Cut off a partial last line, left by a run interrupted while writing
+        it, so new results start on a line of their own.
+        """
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def open(self):
+        if self.path == '-':
+            self.file = sys.stdout
+        else:
+            if os.path.exists(self.path):
+                self.trim()
+            new = not os.path.exists(self.path) or not os.path.getsize(self.path)
+            self.file = open(self.path, 'a', encoding='utf-8', newline='')
+        if self.fmt == 'csv':
+            self.csv = csv.DictWriter(self.file, FIELDS, extrasaction='ignore')
+            if self.path == '-' or new:
+                self.csv.writeheader()
+
+    def write(self, result):
+        if self.csv:
+            self.csv.writerow(result)
+        else:
+            self.file.write(json.dumps(result) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file and self.file is not sys.stdout:
+            self.file.close()
+
+
+class BulkRoller:
+    """
+    Rolls one seed per match, either a DWR seed from flags (exactly as a
+    race room would) or an OoTR seed from a preset on ootrandomizer.com.
+    """
+    def __init__(self, writer, flags=None, version=None, build_type=None,
+                 preset=None, encrypt=True, zsr=None, seed_secret=None,
+                 concurrency=4, catalog=None):
+        self.writer = writer
+        self.catalog = catalog or VersionCatalog()
+        self.flags = flags
+        self.version = version
+        self.build_type = build_type
+        self.preset = preset
+        self.encrypt = encrypt
+        self.zsr = zsr
+        self.seed_secret = seed_secret
+        self.concurrency = concurrency
+        self.written = 0
+        self.failed = 0
+
+    def roll_dwr(self, match):
+        """
+        Roll a DWR seed for a match. Seeds are derived from the seed secret
+        (with the match name standing in for the race name) if there is one,
+        or picked at random.
+        """
+        if self.seed_secret:
+            seed = derive_seed(self.seed_secret, match)
+        else:
+            seed = random.randint(SEED_MIN, SEED_MAX)
+        return {
+            'match': match,
+            'version': self.version,
+            'build_type': self.build_type,
+            'flags': self.flags,
+            'seed': seed,
+            'url': self.catalog.seed_url(self.version, self.build_type, self.flags, seed),
+        }
+
+    async def roll_ootr(self, match):
+        """
+        Roll an OoTR seed for a match. Any failure is returned as the
+        match's error, so it is rolled again on the next run.
+        """
+        try:
+            url = await self.zsr.roll_seed(self.preset, self.encrypt)
+        except ZSRError as e:
+            return {'match': match, 'preset': self.preset, 'error': str(e)}
+        except Exception as e:
+            return {'match': match, 'preset': self.preset, 'error': repr(e)}
+        return {'match': match, 'preset': self.preset, 'url': url}
+
+    def emit(self, result):
+        self.writer.write(result)
+        if result.get('error'):
+            self.failed += 1
+        else:
+            self.written += 1
+
+    async def worker(self, queue):
+        while True:
+            match = await queue.get()
+            try:
+                self.emit(await self.roll_ootr(match))
+            except Exception as e:
+                # Keep going, so the queue is always drained.
+                self.failed += 1
+                print('Could not record %s: %r' % (match, e), file=sys.stderr)
+            finally:
+                queue.task_done()
+
+    async def run(self, matches):
+        if not self.preset:
+            for match in matches:
+                self.emit(self.roll_dwr(match))
+            return
+        # A fixed pool of workers, so a long bracket doesn't queue hundreds
+        # of requests at once.
+        queue = asyncio.Queue(self.concurrency * 2)
+        workers = [
+            asyncio.ensure_future(self.worker(queue))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            for match in matches:
+                await queue.put(match)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.zsr.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='randobot bulk',
+        description='Roll one seed per match for a tournament bracket.',
+    )
+    parser.add_argument('matches', type=str, help='file listing one match per line, or - for stdin')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--command', type=str, help='roll DWR seeds like this registry command (e.g. summer, week3)')
+    source.add_argument('--preset', type=str, help='roll OoTR seeds from this ootrandomizer.com preset')
+    parser.add_argument('--flags', type=str, help='roll DWR seeds with these flags (overrides the command\'s)')
+    parser.add_argument('--commands', type=str, help='command registry JSON file')
+    parser.add_argument('--versions-cache', type=str, help='version catalog snapshot to use instead of the bundled one')
+    parser.add_argument('--version', type=str, help='DWR randomizer version or alias, e.g. latest (default: the command\'s, or latest)')
+    parser.add_argument('--build-type', type=str, help='DWR build type (default: the command\'s, or release)')
+    parser.add_argument('--seed-secret', type=str, default=os.environ.get('RANDOBOT_SEED_SECRET'), help='derive DWR seeds from this secret (default: $RANDOBOT_SEED_SECRET)')
+    parser.add_argument('--spoiler', action='store_true', help='roll OoTR seeds with spoiler logs')
+    parser.add_argument('--ootr-api-key', type=str, help='ootrandomizer.com API key, needed for --preset')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous ootrandomizer.com requests (default: 4)')
+    parser.add_argument('--output', '-o', type=str, default='-', help='file to append results to (default: stdout)')
+    parser.add_argument('--format', type=str, choices=('jsonl', 'csv'), help='output format (default: from the output file name, or jsonl)')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('csv' if args.output.endswith('.csv') else 'jsonl')
+    writer = ResultWriter(args.output, fmt)
+
+    catalog = VersionCatalog(snapshot_path=args.versions_cache)
+    flags = args.flags
+    version = args.version
+    build_type = args.build_type
+    zsr = None
+    if args.command:
+        command = CommandRegistry(args.commands).get(args.command)
+        if not command:
+            parser.error('unknown command: %s' % args.command)
+        flags = flags or command.flags
+        if not flags:
+            parser.error('!%s takes its flags from the room; give --flags' % args.command)
+        version = version or command.version
+        build_type = build_type or command.build_type
+    if args.preset:
+        if not args.ootr_api_key:
+            parser.error('--preset needs --ootr-api-key')
+        zsr = ZSR(args.ootr_api_key, max_concurrency=args.concurrency)
+    else:
+        if not flags:
+            parser.error('give --flags, --command or --preset')
+        build = catalog.resolve(version or 'latest')
+        if not build:
+            parser.error('unknown version: %s' % version)
+        version = build.version
+        build_type = build_type or build.build_type
+        schema = schema_for(version, build_type)
+        if schema:
+            try:
+                flags = decode_flags(flags, schema.name).flagstring
+            except FlagError as e:
+                parser.error('invalid flags: %s' % e)
+
+    done = writer.done()
+    if done:
+        print('Skipping %d matches already in %s.' % (len(done), args.output), file=sys.stderr)
+    matches = []
+    for match in read_matches(args.matches):
+        if match not in done:
+            done.add(match)
+            matches.append(match)
+
+    roller = BulkRoller(
+        writer,
+        flags=flags,
+        version=version,
+        build_type=build_type,
+        preset=args.preset,
+        encrypt=not args.spoiler,
+        zsr=zsr,
+        seed_secret=args.seed_secret,
+        concurrency=args.concurrency,
+        catalog=catalog,
+    )
+    writer.open()
+    try:
+        asyncio.run(roller.run(matches))
+    except KeyboardInterrupt:
+        print('Interrupted; run again to finish the rest.', file=sys.stderr)
+        return 1
+    finally:
+        writer.close()
+    print('Rolled %d seeds, %d failed.' % (roller.written, roller.failed), file=sys.stderr)
+    return 1 if roller.failed else 0
@@ -0,0 +1,95 @@
+import asyncio
+
+from .outbox import Clock, TokenBucket
+
+
+class CommandScheduler:
+    """
+    Runs the chat commands for a single race room.
+
+    Commands run as their own tasks, so a slow command (e.g. one waiting on
+    ootrandomizer.com) doesn't stop the room's messages from being read.
+    Commands that change the room's state are "exclusive": they run one at a
+    time, in the order they arrived. While an exclusive command is queued or
+    running, identical requests (same key: command, arguments and whether
+    the sender may moderate) are collapsed into it rather than run again.
+
+    Each user also gets a token bucket, allowing `user_burst` commands at
+    once and `user_rate` per second after that; commands beyond that are
+    dropped.
+    """
+    user_rate = 0.5
+    user_burst = 3
+
+    def __init__(self, logger, name=None, clock=None):
+        self.logger = logger
+        self.name = name
+        self.clock = clock or Clock()
+        self.lock = asyncio.Lock()
+        self.in_flight = {}
+        self.buckets = {}
+        self.tasks = set()
+        self.collapsed = 0
+        self.limited = 0
+
+    def allow(self, user):
+        """
+        Take a token from a user's bucket. Returns False if they are over
+        their limit.
+        """
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            bucket = self.buckets[user] = TokenBucket(self.user_rate, self.user_burst, self.clock)
+        return bucket.take() == 0
+
+    def submit(self, key, run, exclusive=True, user=None):
+        """
+        Schedule a command.
+
+        `key` identifies the request (e.g. command name and arguments), `run`
+        is a coroutine function taking no arguments and `user` identifies who
+        sent it, or is None to skip rate limiting.
+
+        Returns the task running the command (resolving to what `run`
+        returns), which may be shared with an identical request, or None if
+        the command was dropped.
+        """
+        if user is not None and not self.allow(user):
+            self.limited += 1
+            self.logger.info('[%(race)s] Rate limited %(user)s' % {
+                'race': self.name,
+                'user': user,
+            })
+            return None
+        if exclusive and key in self.in_flight:
+            self.collapsed += 1
+            return self.in_flight[key]
+
+        task = asyncio.ensure_future(self._run(run, exclusive))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        if exclusive:
+            self.in_flight[key] = task
+            task.add_done_callback(lambda task: self.in_flight.pop(key, None))
+        return task
+
+    async def _run(self, run, exclusive):
+        if exclusive:
+            async with self.lock:
+                return await run()
+        return await run()
+
+    async def join(self):
+        """
+        Wait for every scheduled command to finish.
+        """
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def close(self):
+        """
+        Cancel any commands still queued or running.
+        """
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
@@ -0,0 +1,124 @@
+import base64
+import binascii
+from functools import lru_cache
+
+
+class FlagError(ValueError):
+    """
+    Raised when a flagstring is not valid for the randomizer it is used with.
+    """
+
+
+class FlagSchema:
+    """
+    Shape of the flagstrings used by one family of randomizer builds.
+
+    Flagstrings are base32 (RFC 4648, no padding) encodings of a byte array
+    in which every option takes two bits: 0 for off, 1 for on and 2 for
+    random.
+    """
+    __slots__ = ('name', 'label', 'length')
+
+    def __init__(self, name, label, length):
+        self.name = name
+        self.label = label
+        self.length = length
+
+    @property
+    def options(self):
+        return self.length * 5 // 2
+
+
+FLAG_SCHEMAS = {
+    'mcgrew': FlagSchema('mcgrew', 'DWR v3', 24),
+    'juef': FlagSchema('juef', 'juef', 40),
+}
+SCHEMAS_BY_LENGTH = {schema.length: schema for schema in FLAG_SCHEMAS.values()}
+
+FLAG_ALPHABET = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ234567')
+
+
+def schema_for(version, build_type):
+    """
+    Return the FlagSchema for a race's version and build type, or None if
+    its flags can't be checked (e.g. v2 builds).
+    """
+    if build_type == 'juef' or (version or '').startswith('juef'):
+        return FLAG_SCHEMAS['juef']
+    if (version or '').startswith(('v3', 'v2025-TE')):
+        return FLAG_SCHEMAS['mcgrew']
+    return None
+
+
+class Flags:
+    """
+    A decoded flagstring.
+
+    The options are kept as a single integer bitfield, with the first option
+    in the two most significant bits.
+    """
+    __slots__ = ('flagstring', 'schema', 'bits')
+
+    def __init__(self, flagstring, schema, bits):
+        self.flagstring = flagstring
+        self.schema = schema
+        self.bits = bits
+
+    def option(self, index):
+        """
+        Return the value (0-3) of the option at the given index.
+        """
+        shift = (self.schema.options - 1 - index) * 2
+        return (self.bits >> shift) & 0b11
+
+    def summary(self):
+        """
+        Return a short human-readable description of these flags.
+        """
+        counts = [0, 0, 0, 0]
+        for index in range(self.schema.options):
+            counts[self.option(index)] += 1
+        return '%(label)s flags: %(on)d options on, %(random)d random' % {
+            'label': self.schema.label,
+            'on': counts[1],
+            'random': counts[2],
+        }
+
+
+@lru_cache(maxsize=1024)
+def decode_flags(flagstring, schema_name=None):
+    """
+    Decode and validate a flagstring, returning a Flags object.
+
+    If schema_name is not given the schema is guessed from the length of the
+    flagstring. Lowercase letters are accepted and normalised to uppercase.
+    Results are memoized, since the same flags get rolled in many rooms.
+
+    Raises FlagError if the flagstring is not valid.
+    """
+    flagstring = flagstring.strip().upper()
+    if schema_name:
+        schema = FLAG_SCHEMAS[schema_name]
+    else:
+        schema = SCHEMAS_BY_LENGTH.get(len(flagstring))
+        if not schema:
+            raise FlagError(
+                'flags should be %s characters long, not %d' % (
+                    ' or '.join(str(length) for length in sorted(SCHEMAS_BY_LENGTH)),
+                    len(flagstring),
+                )
+            )
+    if len(flagstring) != schema.length:
+        raise FlagError('%s flags should be %d characters long, not %d' % (
+            schema.label, schema.length, len(flagstring),
+        ))
+    bad = sorted(set(flagstring) - FLAG_ALPHABET)
+    if bad:
+        raise FlagError('flags can\'t contain %s' % ', '.join(
+            '"%s"' % char for char in bad
+        ))
+    try:
+        data = base64.b32decode(flagstring)
+    except binascii.Error as e:
+        raise FlagError(str(e)) from e
+    return Flags(flagstring, schema, int.from_bytes(data, 'big'))
@@ -1,12 +1,17 @@
+from functools import partial
 from racetime_bot import RaceHandler, monitor_cmd, can_moderate, can_monitor
+import asyncio
 import random
+import time
 
-# Acceptable seed range: exactly 13 digits
-SEED_MIN = 1_000_000_000_000
-SEED_MAX = 9_999_999_999_999
-
-current_mcgrew_version = "v3.0.3"
-current_juef_version = "juef-v3.0.3.20"
+from .dispatch import CommandScheduler
+from .flags import FlagError, decode_flags, schema_for
+from .logs import current_command, current_race
+from .outbox import Outbox
+from .seeds import SEED_MAX, SEED_MIN, derive_seed, find_reroll
+from .state import trim_race_data
+from .versions import VersionCatalog
+from .watchdog import Load
 
 class RandoHandler(RaceHandler):
     """
@@ -14,34 +19,316 @@ class RandoHandler(RaceHandler):
     """
     stop_at = ['cancelled', 'finished']
 
-    def __init__(self, **kwargs):
+    # Commands that don't change the room's state, and so may run alongside
+    # others. Everything else runs one at a time.
+    read_only_commands = {'flags', 'url', 'verify'}
+
+    # Actions the admin API can run in every matching room at once.
+    admin_actions = ('lock', 'unlock', 'clear')
+
+    # Set by RaceHandler.__init__, after the first assignment to data.
+    state = None
+
+    def __init__(self, catalog=None, metrics=None, recorder=None,
+                 registry=None, schedule=None, seed_pool=None,
+                 seed_secret=None, store=None, watchdog=None, zsr=None,
+                 clock=None, **kwargs):
         super().__init__(**kwargs)
+        self.catalog = catalog or VersionCatalog()
+        self.metrics = metrics
+        self.recorder = recorder
+        self.recording = None
+        self.registry = registry
+        self.schedule = schedule
+        self.seed_pool = seed_pool
+        self.seed_secret = seed_secret
+        self.store = store
+        self.watchdog = watchdog
+        self.zsr = zsr
+        self.outbox = Outbox(
+            partial(RaceHandler.send_message, self),
+            partial(RaceHandler.set_raceinfo, self),
+            logger=self.logger,
+            metrics=self.metrics,
+            watchdog=self.watchdog,
+            clock=clock,
+        )
+        self.commands = CommandScheduler(logger=self.logger, clock=clock)
+        self._scheduled_task = None
+
+    @property
+    def data(self):
+        """
+        The race data, trimmed down to what the bot uses. Setting it also
+        updates the goal and status in the room's state.
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = trim_race_data(data)
+        if self.state is not None:
+            self.state.update_race(self._data)
+
+    def should_stop(self):
+        return self.state.status.value in self.stop_at
+
+    async def handle(self):
+        """
+        Run the race room handler, with a running outbox, recording its
+        traffic if a recorder is configured.
+        """
+        self.outbox.name = self.data.get('name')
+        self.commands.name = self.data.get('name')
+        # Tag every log record from this room (and its tasks) with the race.
+        current_race.set(self.data.get('name'))
+        if self.recorder:
+            from .recorder import RecordingConnection
+
+            self.recording = self.recorder.open(self.data.get('name'))
+            self.recording.write('start', {
+                'race': self.data,
+                'state': self.state.to_dict(),
+            })
+            self.conn = RecordingConnection(self.conn, self.recording)
+        self.outbox.start()
+        try:
+            await super().handle()
+        finally:
+            if self._scheduled_task:
+                self._scheduled_task.cancel()
+            await self.commands.close()
+            await self.outbox.close()
+            if self.metrics:
+                self.metrics.forget_race(self.outbox.name)
+            if self.recording:
+                self.recording.write('end', {'state': self.state.to_dict()})
+                self.recorder.close(self.recording)
+
+    async def end(self):
+        """
+        Finish running commands and send anything still queued before
+        disconnecting, and forget the room's stored state.
+        """
+        await self.commands.join()
+        await self.outbox.flush()
+        if self.store:
+            self.store.delete(self.data.get('name'))
+
+    def save_state(self):
+        """
+        Persist the room's state, if a state store is configured.
+        """
+        if self.store:
+            self.store.save(self.data.get('name'), self.state.to_dict())
+
+    async def send_message(self, message, coalesce=True, dedupe=False,
+                           essential=True):
+        """
+        Queue a chat message for the race room. Returns immediately.
+
+        Consecutive queued messages may be joined into one, unless coalesce
+        is False. With dedupe, the message is dropped if it was already sent
+        in the last few seconds (use for refusals, so a flood of commands
+        gets one reply). Non-essential messages are held back, or dropped,
+        while the bot is under load.
+        """
+        self.outbox.put_message(
+            message,
+            coalesce=coalesce,
+            dedupe=dedupe,
+            essential=essential,
+        )
+
+    async def set_raceinfo(self, info, overwrite=False, prefix=True):
+        """
+        Queue a race info update for the race room. Returns immediately.
+
+        Supersedes any earlier update that has not been sent yet.
+        """
+        self.outbox.put_raceinfo(info, overwrite=overwrite, prefix=prefix)
+
+    def get_command(self, name):
+        """
+        Return a coroutine function handling the given command, or None.
+
+        Handler methods (ex_*) take precedence over registry commands.
+        """
+        method = getattr(self, 'ex_' + name, None)
+        if method:
+            return method
+        command = self.registry.get(name) if self.registry else None
+        if command:
+            return partial(self.roll_command, command)
+        return None
+
+    async def chat_message(self, data):
+        """
+        Consume an incoming "chat.message" type message, dispatching
+        commands to handler methods or the command registry.
+        """
+        message = data.get('message', {})
+
+        if message.get('is_bot') or message.get('is_system'):
+            self.logger.info('Ignoring bot/system message.')
+            return
+
+        words = message.get('message', '').lower().split(' ')
+        if words and words[0].startswith(self.command_prefix.lower()):
+            name = words[0][len(self.command_prefix):]
+            command = self.get_command(name)
+            args = words[1:]
+            if command:
+                if (
+                    name in self.read_only_commands
+                    and self.watchdog
+                    and self.watchdog.level >= Load.CRITICAL
+                ):
+                    self.logger.info(
+                        '[%(race)s] Ignoring !%(command)s under load.'
+                        % {'race': self.data.get('name'), 'command': name}
+                    )
+                    return
+                user = message.get('user', {})
+                privileged = can_monitor(message) or can_moderate(message)
+                self.commands.submit(
+                    # Only collapse into a request from someone with the same
+                    # privileges, or e.g. a monitor's !lock could be dropped
+                    # in favour of a user's, which is then refused.
+                    key=(privileged,) + tuple(words),
+                    run=partial(self.run_command, name, command, args, message),
+                    exclusive=name not in self.read_only_commands,
+                    user=None if privileged else (
+                        user.get('id') or user.get('name')
+                    ),
+                )
+
+    async def run_command(self, name, command, args, message):
+        """
+        Run a chat command, recording metrics and saving state afterwards.
+        Returns False if the command raised an exception, otherwise True.
+        """
+        current_command.set(name)
+        self.logger.info('[%(race)s] Calling handler for %(word)s' % {
+            'race': self.data.get('name'),
+            'word': self.command_prefix + name,
+        })
+        started = time.perf_counter()
+        ok = True
+        try:
+            await command(args, message)
+        except Exception:
+            ok = False
+            self.logger.error('Command raised exception.', exc_info=True)
+            if self.metrics:
+                self.metrics.command_errors.inc(command=name)
+        if self.metrics:
+            self.metrics.command_duration.observe(
+                time.perf_counter() - started,
+                command=name,
+            )
+        self.save_state()
+        return ok
 
     async def begin(self):
         """
-        Send introduction messages.
+        Send introduction messages, and start any scheduled seed roll.
         """
         if self.should_stop():
             return
-        if not self.state.get('intro_sent') and not self._race_in_progress():
-            goal_name = self.data.get('goal', {}).get('name')
-            if (goal_name == 'Standard Flags' or goal_name == 'Tournament'):
+        if not self.state.intro_sent and not self._race_in_progress():
+            if self.state.goal.is_standard:
                 await self.send_message(
-                    'Welcome to DWR! Create a standard seed with !roll or !summer for 2026 Summer Tournament Edition'
+                    'Welcome to DWR! Create a standard seed with !roll or !summer for 2026 Summer Tournament Edition',
+                    essential=False,
                 )
             else:
                 await self.send_message(
-                    'Welcome to DWR! Create a custom flag seed with !dwflags <flags> or with !juef <flags>'
+                    'Welcome to DWR! Create a custom flag seed with !dwflags <flags> or with !juef <flags>',
+                    essential=False,
                 )
             await self.send_message(
-                'Full list of raceroom commands at https://pastebin.com/raw/4nKVRxXR'
+                'Full list of raceroom commands at https://pastebin.com/raw/4nKVRxXR',
+                essential=False,
             )
-            self.state['intro_sent'] = True
-        if 'locked' not in self.state:
-            self.state['locked'] = False
+            self.state.intro_sent = True
+        self.plan_scheduled_roll()
+        if self.state.scheduled_roll and not self._scheduled_task:
+            self._scheduled_task = asyncio.ensure_future(self.wait_scheduled_roll())
+        self.save_state()
 
-        self.state['seed_rolled'] = False
-        self.state['build_type'] = 'release'
+    def plan_scheduled_roll(self):
+        """
+        Check the room against the schedule (once per room), and keep a
+        pending roll in the room's state if it matches.
+        """
+        if not self.schedule or self.state.schedule_checked:
+            return
+        self.state.schedule_checked = True
+        if self.state.locked or self.state.seed_rolled or self._race_in_progress():
+            return
+        job = self.schedule.plan(self.data)
+        if job:
+            self.state.scheduled_roll = job
+            self.logger.info(
+                '[%(race)s] Scheduled a seed roll (%(what)s) in %(delay)ds'
+                % {
+                    'race': self.data.get('name'),
+                    'what': job['command'] or job['preset'],
+                    'delay': job['due'] - time.time(),
+                }
+            )
+
+    async def wait_scheduled_roll(self):
+        """
+        Wait until the pending scheduled roll is due, then queue it like a
+        command. While the bot is under load, the roll is put off until load
+        drops or its latest time comes.
+        """
+        job = self.state.scheduled_roll
+        await asyncio.sleep(max(0, job['due'] - time.time()))
+        if self.watchdog and self.watchdog.level > Load.NORMAL:
+            try:
+                await asyncio.wait_for(
+                    self.watchdog.normal.wait(),
+                    timeout=max(0, job['latest'] - time.time()),
+                )
+            except asyncio.TimeoutError:
+                pass
+        self.commands.submit(
+            key=('scheduled',),
+            run=partial(self.run_command, 'scheduled', self.roll_scheduled, [], {}),
+            exclusive=True,
+            user=None,
+        )
+
+    async def roll_scheduled(self, args, message):
+        """
+        Roll the pending scheduled seed, unless the room has been locked or
+        a seed rolled in the meantime.
+        """
+        job = self.state.scheduled_roll
+        self.state.scheduled_roll = None
+        if not job or self._race_in_progress():
+            return
+        if self.state.locked or self.state.seed_rolled:
+            self.logger.info(
+                '[%(race)s] Skipping scheduled seed roll, the room is locked '
+                'or already has a seed.' % {'race': self.data.get('name')}
+            )
+            return
+        if job['command']:
+            command = self.registry.get(job['command']) if self.registry else None
+            if not command or not command.flags:
+                self.logger.warning(
+                    '[%(race)s] Scheduled command "%(command)s" doesn\'t exist '
+                    'or has no flags.'
+                    % {'race': self.data.get('name'), 'command': job['command']}
+                )
+                return
+            await self.roll_command(command, args, message)
+        elif self.zsr:
+            await self.roll_preset(job['preset'], encrypt=job['encrypt'])
 
     @monitor_cmd
     async def ex_lock(self, args, message):
@@ -50,10 +337,7 @@ class RandoHandler(RaceHandler):
 
         Prevent seed rolling unless user is a race monitor.
         """
-        self.state['locked'] = True
-        await self.send_message(
-            'Lock initiated. I will now only roll seeds for race monitors.'
-        )
+        await self.lock()
 
     @monitor_cmd
     async def ex_unlock(self, args, message):
@@ -64,10 +348,7 @@ class RandoHandler(RaceHandler):
         """
         if self._race_in_progress():
             return
-        self.state['locked'] = False
-        await self.send_message(
-            'Lock released. Anyone may now roll a seed.'
-        )
+        await self.unlock()
 
     async def ex_dwflags(self, args, message):
         await self.ex_dwflags3(args, message);
@@ -78,14 +359,15 @@ class RandoHandler(RaceHandler):
         """
         if self._race_in_progress():
             return
-        if not self.state.get('race_version'):
-            self.state['race_version'] = current_mcgrew_version
+        if not self.state.race_version:
+            self.state.race_version = self.catalog.latest('release')
         await self.roll_and_send_v3(args, message)
 
     async def ex_version(self, args, message):
         """
-        Handle !version commands. Must start with "v" and can be 
-        executed before or after rolling the seed.
+        Handle !version commands. Takes a known version (ex.: "v3.0.3") or
+        "latest", "latest-beta" or "latest-juef", and can be executed before
+        or after rolling the seed.
         """
         if self._race_in_progress():
             return
@@ -93,112 +375,122 @@ class RandoHandler(RaceHandler):
             await self.send_message('Hey, you forgot a new version.')
             return
 
-        words = message.get('message', '').split(' ')
-        version = words[1]
-        if (version.startswith('v') == False):
-            await self.send_message('Versions must start with "v" (ex.: "v2.2")')
+        build = self.catalog.resolve(args[0])
+        if not build:
+            await self.send_message(
+                'Sorry, I don\'t know version {}. Try "!version latest" '
+                '(currently {}).'.format(args[0], self.catalog.latest('release')),
+                dedupe=True,
+            )
             return
-        self.state['race_version'] = version
-        await self.send_message('Seed version updated to: {}'.format(version))
+        self.state.race_version = build.version
+        self.state.build_type = build.build_type
+        await self.send_message('Seed version updated to: {}'.format(build.version))
         await self.update_info()
 
     async def ex_beta(self, args, message):
         """
-        Handle !beta commands. Requires a version and build number.
-        Version starts with "v" and this command can be 
-        executed before or after rolling the seed.
+        Handle !beta commands. Requires a version and build number of a
+        known beta build, and can be executed before or after rolling the
+        seed.
         """
         if self._race_in_progress():
             return
         if len(args) != 2:
             await self.send_message('Hey, you forgot a new version and build number.')
-            await self.send_message('Example: !beta v3.0.3 670')
+            # Show the latest beta, e.g. "v3.0.4-b701" as "!beta v3.0.4 701".
+            version, _, build_number = self.catalog.latest('beta').rpartition('-b')
+            await self.send_message('Example: !beta {} {}'.format(version, build_number))
             return
 
-        words = message.get('message', '').split(' ')
-        if (words[1].startswith('v') == False):
-            await self.send_message('Versions must start with "v" (ex.: "v2.2")')
+        build = self.catalog.beta(args[0], args[1])
+        if not build:
+            await self.send_message(
+                'Sorry, I don\'t know beta {} build {}. The latest beta is {}.'.format(
+                    args[0], args[1], self.catalog.latest('beta'),
+                ),
+                dedupe=True,
+            )
             return
-        await self.set_beta(words[1:])
-
+        await self.set_beta(build)
 
-    async def set_beta(self, words):
+    async def set_beta(self, build):
         """
-        Sets the beta active and with the given version in words.
+        Sets the given beta build active.
         """
-        version = words[0] + 'b' + words[1]
-        self.state['race_version'] = version
-        self.state['build_type'] = 'beta'
-        await self.send_message('Seed version updated to: {}'.format(version))
+        self.state.race_version = build.version
+        self.state.build_type = 'beta'
+        await self.send_message('Seed version updated to: {}'.format(build.version))
         await self.update_info()
 
-    async def ex_url(self, args, message):
-        await self.print_url()
-
-    async def ex_clear(self, args, message):
+    async def ex_flags(self, args, message):
         """
-        Clears seed and flag from internal state and raceroom info.
+        Handle !flags commands. Describes the given flags, or the flags of
+        the seed rolled in this room.
         """
-        if self._race_in_progress():
+        if args:
+            flags = args[0]
+            schema = None
+        elif self.state.seed_rolled and self.state.race_flagstring:
+            flags = self.state.race_flagstring
+            schema = schema_for(self.state.race_version, self.state.build_type)
+        else:
+            await self.send_message('Hey, you forgot flags.')
             return
-        await self.clear()
+        try:
+            decoded = decode_flags(flags, schema.name if schema else None)
+        except FlagError as e:
+            await self.send_message('Those flags don\'t look right: %s.' % e)
+            return
+        await self.send_message('%s: %s' % (decoded.flagstring, decoded.summary()))
 
-    async def ex_roll(self, args, message):
-        await self.ex_roll3(args, message);
+    async def ex_url(self, args, message):
+        await self.print_url()
 
-    async def ex_roll3(self, args, message):
+    async def ex_verify(self, args, message):
         """
-        Rolls a new seed with the room default flags for version 3.0.
+        Handle !verify commands. Checks that the given seed, or the seed
+        rolled in this room, was derived from the server secret for this
+        room rather than picked by hand.
         """
-        reply_to = message.get('user', {}).get('name')
-        if self._race_in_progress():
+        if not self.seed_secret:
+            await self.send_message('Seed verification isn\'t enabled here.')
             return
-        goal_name = self.data.get('goal', {}).get('name')
-        if (goal_name == 'Standard Flags'):
-            self.state['race_version'] = current_mcgrew_version
-            await self.roll(
-                flags="IVIAAVCEKACAAAAAAAAAAEAQ",
-                reply_to=reply_to,
-            )
+        if args:
+            try:
+                seed = int(args[0])
+            except ValueError:
+                await self.send_message('That doesn\'t look like a seed.')
+                return
+        elif self.state.seed_rolled:
+            seed = self.state.race_seed
         else:
-            await self.send_message('This command only works in Standard')
-
-    async def ex_summer(self, args, message):
-        """
-        Rolls a new seed with the room default flags for 2026 Summer Tournament Edition.
-        """
-        reply_to = message.get('user', {}).get('name')
-        if self._race_in_progress():
+            await self.send_message('No seed has been rolled here yet.')
             return
-        goal_name = self.data.get('goal', {}).get('name')
-        if (goal_name == 'Standard Flags' or goal_name == 'Tournament'):
-            self.state['race_version'] = 'v3.0.4-b701'
-            self.state['build_type'] = 'beta'
-            await self.roll(
-                flags="IVIAAVCFKACAAAAAAAAAAEAQ",
-                reply_to=reply_to,
+        reroll = find_reroll(
+            self.seed_secret,
+            self.data.get('name'),
+            seed,
+            limit=max(self.state.reroll, 1),
+        )
+        if reroll is None:
+            await self.send_message(
+                'Seed %(seed)d was NOT rolled by me for this room.'
+                % {'seed': seed}
             )
         else:
-            await self.send_message('This command only works in Standard and Tournament')
+            await self.send_message(
+                'Seed %(seed)d checks out: it is roll #%(roll)d for this room.'
+                % {'seed': seed, 'roll': reroll + 1}
+            )
 
-    async def ex_summerflags(self, args, message):
+    async def ex_clear(self, args, message):
         """
-        Rolls a new seed with the room custom flags for 2026 Summer Tournament Edition.
+        Clears seed and flag from internal state and raceroom info.
         """
-        reply_to = message.get('user', {}).get('name')
         if self._race_in_progress():
             return
-        goal_name = self.data.get('goal', {}).get('name')
-        if (goal_name == 'Standard Flags' or goal_name == 'Tournament'):
-            self.state['race_version'] = 'v3.0.4-b701'
-            self.state['build_type'] = 'beta'
-            words = message.get('message', '').split(' ')
-            await self.roll(
-                flags=words[1],
-                reply_to=reply_to,
-            )
-        else:
-            await self.send_message('This command only works in Standard and Tournament')
+        await self.clear()
 
     async def ex_juef(self, args, message):
         """
@@ -207,123 +499,51 @@ class RandoHandler(RaceHandler):
         reply_to = message.get('user', {}).get('name')
         if self._race_in_progress():
             return
-        goal_name = self.data.get('goal', {}).get('name')
-        if (goal_name == 'Standard Flags' or goal_name == 'Tournament'):
-            await self.send_message('This command does not work in Standard or Tournament')
+        if self.state.goal.is_standard:
+            await self.send_message('This command does not work in Standard or Tournament', dedupe=True)
             return
         else:
-            self.state['race_version'] = current_juef_version
-            self.state['build_type'] = 'juef'
+            self.state.race_version = self.catalog.latest('juef')
+            self.state.build_type = 'juef'
             await self.roll_and_send_v3(args, message)
 
-    async def ex_week1(self, args, message):
+    async def roll_command(self, command, args, message):
         """
-        Rolls a new seed with the week 1 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('CVKQAVCECUABCQAAIAAAAZAQ', 'It`s Winter Chaos Time', args, message)
-        await self.roll3juef('IVKEAVAUKACBIQAACAAAAEIUAAQBAAAAABYKCAAA', 'Winter Ain’t Too Cold Yet ❄️', args, message)
-
-    async def ex_week2(self, args, message):
-        """
-        Rolls a new seed with the week 2 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('IVIAAVCFKECBAQCAKEAAAZBU', 'Big Swamp? No Hurtmore? No Problem!', args, message)
-        await self.roll3juef('KVIAAVCEKACBAAAAAAAAAEAUBIQCAAIEAVSGGEAB', 'No Gold Grind? Easy! 💳', args, message)
-
-    async def ex_week3(self, args, message):
-        """
-        Rolls a new seed with the week 3 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('IQAAAVCUAAABAAIAIAAAAIAQ', 'Neapolitan-ish', args, message)
-        await self.roll3juef('AQAAAVCEKACBAAAAAAAAAEAUAAQFACAQACICGAEB', 'Vanilla++ 🍦', args, message)
-
-    async def ex_week4(self, args, message):
-        """
-        Rolls a new seed with the week 4 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('UWVIA2CEVIUBVAAKUIAABWQQ', 'Random%', args, message)
-        await self.roll3juef('IVIQAVCEKUCBAAAAAAAAAKIUAAQBAAABCBYCCBMB', 'Gotta Love Chaos 💥', args, message)
-
-    async def ex_week5(self, args, message):
-        """
-        Rolls a new seed with the week 5 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('KVIUAVCEKUABAAAAIAAAAFJU', 'ChaosThe2nd', args, message)
-        await self.roll3juef('KVIAIVCEKECBAAAAAEAAAUIUIAQBAAIFABYOCVBA', 'Stair Shuffle made easy…ish 𓊍', args, message)
-
-    async def ex_week6(self, args, message):
-        """
-        Rolls a new seed with the week 6 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('KVIAIVCFKUABAAAAIAAAAEJU', 'Stair Shuffle Chaos', args, message)
-        await self.roll3juef('IVIAAVCEKACBAAAAAQAAAEIUAAQBAQABABYCGFFB', 'Watch Your Head (and other people’s) 🤕', args, message)
-
-    async def ex_week7(self, args, message):
-        """
-        Rolls a new seed with the week 7 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('UWJIAVCVSJCBAAAAMAAAAGRU', 'Random Repel Runback', args, message)
-        await self.roll3juef('IVIQAVCEKQCBAAAAAAAAAUAUAVQRIBCAABYCCAIA', 'Go Mode? Don’t Know Mode 🏁', args, message)
-
-    async def ex_week8a(self, args, message):
-        """
-        Rolls a new seed with the week 8a 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('IVIAAVCAKACBAACVCQAAAEJE', 'You No Nothing, Jon Snow', args, message)
-        await self.roll3juef('QVUEQ2CAVKUBFAAAFIAABWQUAAQBAAAAABYKCAAA', 'Kitchen Sink v2026 🚮', args, message)
-
-    async def ex_week8b(self, args, message):
-        """
-        Rolls a new seed with the week 8b 2026 winter league flags.
-        """
-        # WL2025
-        # await self.roll3nonstandard('KVIUIVCEKVABAAAAKEAAAEJU', 'Kitchen Sink!', args, message)
-        await self.roll3juef('KVIQAVCAKUCBAAAVAAAAAYAUABQAASCAABYSCAFB', '🎵 J’suis plus sensible à l’invisible  🎶', args, message)
-
-    async def roll3nonstandard(self, setflags, weekmsg, args, message):
-        """
-        Rolls a new seed with the given flags for version 3.0.
+        Rolls a new seed for a command defined in the command registry.
         """
         reply_to = message.get('user', {}).get('name')
-        
-        goal_name = self.data.get('goal', {}).get('name')
-        if (goal_name == 'Standard Flags' or goal_name == 'Tournament'):
-            await self.send_message('This does not work in Standard or Standard Tournament')
-        else:
-            if not self.state.get('race_version'):
-                self.state['race_version'] = current_mcgrew_version
-            await self.send_message(weekmsg)
-            await self.roll(
-                flags=setflags,
-                reply_to=reply_to,
-            )
+        if self._race_in_progress():
+            return
+        if not command.allows_goal(self.state.goal_name):
+            await self.send_message(command.goal_error, dedupe=True)
+            return
 
-    async def roll3juef(self, setflags, weekmsg, args, message):
-        """
-        Rolls a new seed with the given flags for juef version.
-        """
-        reply_to = message.get('user', {}).get('name')
-        
-        goal_name = self.data.get('goal', {}).get('name')
-        if (goal_name == 'Standard Flags' or goal_name == 'Tournament'):
-            await self.send_message('This does not work in Standard or Standard Tournament')
-        else:
-            if not self.state.get('race_version'):
-                self.state['race_version'] = current_juef_version
-                self.state['build_type'] = 'juef'
-            await self.send_message(weekmsg)
-            await self.roll(
-                flags=setflags,
-                reply_to=reply_to,
-            )
+        flags = command.flags
+        if not flags:
+            if len(args) != 1:
+                await self.send_message('Hey, you forgot flags.')
+                return
+            flags = message.get('message', '').split(' ')[1]
+
+        version = build_type = None
+        if command.version:
+            build = self.catalog.resolve(command.version)
+            version = build.version if build else command.version
+            build_type = command.build_type or (build.build_type if build else None)
+            if not (command.keep_version and self.state.race_version):
+                self.state.race_version = version
+                if build_type:
+                    self.state.build_type = build_type
+        if command.announce:
+            await self.send_message(command.announce)
+        # Check the flags against the command's own build, even when the
+        # room keeps a version of another kind.
+        await self.roll(
+            flags=flags,
+            reply_to=reply_to,
+            version=version,
+            build_type=build_type,
+        )
 
     async def roll_and_send(self, args, message):
         """
@@ -335,17 +555,19 @@ class RandoHandler(RaceHandler):
         if len(args) != 1:
             await self.send_message('Hey, you forgot flags.')
             return
-        if self.state.get('locked') and not can_monitor(message):
+        if self.state.locked and not can_monitor(message):
             await self.send_message(
                 'Sorry %(reply_to)s, seed rolling is locked. Only race '
                 'monitors may roll a seed for this race.'
-                % {'reply_to': reply_to or 'friend'}
+                % {'reply_to': reply_to or 'friend'},
+                dedupe=True,
             )
             return
-        if self.state.get('seed_rolled') and not can_moderate(message):
+        if self.state.seed_rolled and not can_moderate(message):
             await self.send_message(
                 'Well excuuuuuse me princess, but I already rolled a seed. '
-                'Don\'t get greedy!'
+                'Don\'t get greedy!',
+                dedupe=True,
             )
             return
 
@@ -366,17 +588,19 @@ class RandoHandler(RaceHandler):
         if len(args) != 1:
             await self.send_message('Hey, you forgot flags.')
             return
-        if self.state.get('locked') and not can_monitor(message):
+        if self.state.locked and not can_monitor(message):
             await self.send_message(
                 'Sorry %(reply_to)s, seed rolling is locked. Only race '
                 'monitors may roll a seed for this race.'
-                % {'reply_to': reply_to or 'friend'}
+                % {'reply_to': reply_to or 'friend'},
+                dedupe=True,
             )
             return
-        if self.state.get('seed_rolled') and not can_moderate(message):
+        if self.state.seed_rolled and not can_moderate(message):
             await self.send_message(
                 'Well excuuuuuse me princess, but I already rolled a seed. '
-                'Don\'t get greedy!'
+                'Don\'t get greedy!',
+                dedupe=True,
             )
             return
 
@@ -387,57 +611,152 @@ class RandoHandler(RaceHandler):
             reply_to=reply_to,
         )
 
-    async def roll(self, flags, reply_to):
+    async def roll_preset(self, preset, encrypt):
+        """
+        Generate an OoTR seed on ootrandomizer.com from the given preset for
+        a scheduled roll, and post its URL.
         """
-        Roll a new seed and update the race info.
+        from .zsr import ZSRError
+
+        try:
+            presets = await self.zsr.load_presets()
+            if preset not in presets:
+                self.logger.warning(
+                    '[%(race)s] Scheduled preset "%(preset)s" doesn\'t exist.'
+                    % {'race': self.data.get('name'), 'preset': preset}
+                )
+                return
+            if self.seed_pool:
+                seed_uri = await self.seed_pool.get(preset, encrypt)
+            else:
+                seed_uri = await self.zsr.roll_seed(preset, encrypt)
+        except ZSRError:
+            self.logger.error('Unable to roll seed.', exc_info=True)
+            return
+
+        self.state.seed_rolled = True
+        self.state.race_url = seed_uri
+        await self.set_raceinfo(
+            '%(preset)s - %(seed_uri)s'
+            % {'preset': presets[preset], 'seed_uri': seed_uri},
+            overwrite=True,
+        )
+        await self.send_message('Okay, here is your seed: %s' % seed_uri)
+
+    async def roll(self, flags, reply_to, version=None, build_type=None):
         """
-        if (self.state['seed_rolled']):
-          await self.send_message('Seed already rolled! Use !clear before re-rolling.')
+        Roll a new seed and update the race info. The flags are checked
+        against the given version and build type, or the room's.
+        """
+        if (self.state.seed_rolled):
+          await self.send_message('Seed already rolled! Use !clear before re-rolling.', dedupe=True)
           return
 
-        # seeds are 13 digits long; randint's upper bound is inclusive, so
-        # generate values between SEED_MIN and SEED_MAX
-        self.state['race_seed'] = random.randint(SEED_MIN, SEED_MAX)
-        self.state['seed_rolled'] = True
-        self.state['race_flagstring'] = flags
+        if version is None:
+            version, build_type = self.state.race_version, self.state.build_type
+        schema = schema_for(version, build_type)
+        if schema:
+            try:
+                flags = decode_flags(flags, schema.name).flagstring
+            except FlagError as e:
+                await self.send_message(
+                    'Sorry %(reply_to)s, those flags don\'t look right: %(error)s.'
+                    % {'reply_to': reply_to or 'friend', 'error': e}
+                )
+                return
+
+        self.state.race_seed = self.new_seed()
+        self.state.seed_rolled = True
+        self.state.race_flagstring = flags
         await self.update_info()
 
+    def new_seed(self):
+        """
+        Pick the seed for the next roll in this room.
+        """
+        if self.seed_secret:
+            # Derive the seed from the room name and the number of seeds
+            # rolled here so far, so it can be recomputed and verified.
+            reroll = self.state.reroll
+            seed = derive_seed(self.seed_secret, self.data.get('name'), reroll)
+            self.state.reroll = reroll + 1
+        else:
+            # seeds are 13 digits long; randint's upper bound is inclusive,
+            # so generate values between SEED_MIN and SEED_MAX
+            seed = random.randint(SEED_MIN, SEED_MAX)
+        if self.recording:
+            self.recording.write('seed', {'seed': seed, 'reroll': self.state.reroll})
+        return seed
+
+    def submit_admin_action(self, action):
+        """
+        Queue an action from the admin API ("lock", "unlock" or "clear") as
+        an exclusive command, so it takes its turn with the room's chat
+        commands. Returns the command's task, which resolves to "done",
+        "skipped" (unlock and clear leave a race in progress alone) or
+        "failed".
+        """
+        async def command(args, message):
+            await getattr(self, action)()
+
+        async def run():
+            if action != 'lock' and self._race_in_progress():
+                return 'skipped'
+            if await self.run_command('admin_' + action, command, [], {}):
+                return 'done'
+            return 'failed'
+
+        return self.commands.submit(
+            key=('admin', action),
+            run=run,
+            exclusive=True,
+            user=None,
+        )
+
+    async def lock(self):
+        self.state.locked = True
+        await self.send_message(
+            'Lock initiated. I will now only roll seeds for race monitors.'
+        )
+
+    async def unlock(self):
+        self.state.locked = False
+        await self.send_message(
+            'Lock released. Anyone may now roll a seed.'
+        )
+
     async def clear(self):
-        if (self.state['seed_rolled']):
+        if (self.state.seed_rolled):
           await self.set_raceinfo('', overwrite=True)
-        self.state['seed_rolled'] = False
-        self.state['race_flagstring'] = ''
-        self.state['race_seed'] = 0
-        self.state['race_version'] = ''
-        self.state['build_type'] = 'release'
+        self.state.clear()
         await self.send_message('Race info cleared!')
 
     async def update_info(self):
-        if (self.state['seed_rolled']):
+        if (self.state.seed_rolled):
             await self.set_raceinfo('Randomizer {} Seed: {} Flags: {}'.format(
-                self.state['race_version'], 
-                self.state['race_seed'],
-                self.state['race_flagstring']),
+                self.state.race_version, 
+                self.state.race_seed,
+                self.state.race_flagstring),
                 overwrite=True)
+            # The race info already shows this, so it can wait under load.
             await self.send_message('Randomizer {} Seed: {} Flags: {}'.format(
-                self.state['race_version'], 
-                self.state['race_seed'],
-                self.state['race_flagstring']))
+                self.state.race_version, 
+                self.state.race_seed,
+                self.state.race_flagstring),
+                essential=False)
             await self.print_url()
 
     async def print_url(self):
-        build_type=self.state['build_type']
-        if (self.state['seed_rolled'] and build_type == 'juef'):
-            await self.send_message('https://juef17.github.io/dwrandomizer/#flags={}&seed={}&v={}'.format(
-                self.state['race_flagstring'],
-                self.state['race_seed'], 
-                (self.state['race_version']).split("-")[-1]))
+        if not self.state.seed_rolled:
             return
-        if (self.state['seed_rolled'] and (self.state['race_version'].startswith('v3.0') or self.state['race_version'].startswith('v2025-TE'))):
-            await self.send_message('https://dwrandomizer.com/{}/#flags={}&seed={}'.format(
-                build_type,
-                self.state['race_flagstring'], 
-                self.state['race_seed']))
+        url = self.catalog.seed_url(
+            self.state.race_version,
+            self.state.build_type,
+            self.state.race_flagstring,
+            self.state.race_seed,
+        )
+        if url:
+            await self.send_message(url)
 
     def _race_in_progress(self):
-        return self.data.get('status').get('value') in ('pending', 'in_progress')
+        return self.state.status.in_progress
@@ -0,0 +1,186 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import time
+
+from .outbox import TokenBucket
+
+LOG_FORMAT = '[%(asctime)s] %(name)s (%(levelname)s) :: %(message)s'
+
+# The race room and chat command being handled, if any. Set by RandoHandler
+# and inherited by every task it starts.
+current_race = contextvars.ContextVar('current_race', default=None)
+current_command = contextvars.ContextVar('current_command', default=None)
+
+# High-volume log lines, by category. These are subject to sampling (see
+# SamplingFilter).
+SAMPLED_CATEGORIES = {
+    'frame': re.compile(r'\] Received '),
+    'websocket': re.compile(r'^[<>] (TEXT|BINARY|PING|PONG) '),
+    'message': re.compile(r'\] Message: '),
+    'raceinfo': re.compile(r'\] Set info: '),
+    'ignored': re.compile(r'^Ignoring bot/system message|^No handler for '),
+}
+
+
+class ContextFilter(logging.Filter):
+    """
+    Adds the current race and command to every record.
+    """
+    def filter(self, record):
+        record.race = current_race.get()
+        record.command = current_command.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `rate` records per second for each high-volume
+    category in SAMPLED_CATEGORIES, and counts the rest. Only INFO and DEBUG
+    records are sampled.
+    """
+    def __init__(self, rate, categories=SAMPLED_CATEGORIES):
+        super().__init__()
+        self.rate = rate
+        self.categories = categories
+        self.buckets = {
+            category: TokenBucket(rate, max(rate, 1))
+            for category in categories
+        }
+        self.dropped = dict.fromkeys(categories, 0)
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        message = record.getMessage()
+        for category, pattern in self.categories.items():
+            if pattern.search(message):
+                if self.buckets[category].take():
+                    self.dropped[category] += 1
+                    return False
+                record.sampled = category
+                return True
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'race': getattr(record, 'race', None),
+            'command': getattr(record, 'command', None),
+        }
+        if getattr(record, 'sampled', None):
+            entry['sampled'] = record.sampled
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that never blocks the caller. If the queue is full (the
+    output can't keep up), the record is dropped and counted instead.
+    """
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, but leave the formatting
+        # itself to the listener thread.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DropReporter(logging.Filter):
+    """
+    Listener-side filter that logs how many records were dropped since the
+    last report, at most every `every` seconds.
+    """
+    every = 60
+
+    def __init__(self, queue_handler, sampler=None):
+        super().__init__()
+        self.queue_handler = queue_handler
+        self.sampler = sampler
+        self.reported_at = time.monotonic()
+
+    def filter(self, record):
+        now = time.monotonic()
+        if now - self.reported_at >= self.every:
+            self.reported_at = now
+            dropped = self.queue_handler.dropped
+            self.queue_handler.dropped = 0
+            sampled = {}
+            if self.sampler:
+                sampled = {k: v for k, v in self.sampler.dropped.items() if v}
+                self.sampler.dropped = dict.fromkeys(self.sampler.dropped, 0)
+            if dropped or sampled:
+                record.msg = '%s (log: %d dropped, sampled out %s)' % (
+                    record.msg, dropped, sampled or 'nothing',
+                )
+        return True
+
+
+def configure_logging(verbose=False, json_format=False, sample_rate=None,
+                      queue_size=10000):
+    """
+    Set up the root logger to write to stdout, and return it.
+
+    Records are put on a queue and written by a background thread, so a slow
+    stdout never delays the event loop. With json_format, each record is
+    written as a JSON object including the race and command it came from.
+    With sample_rate, high-volume lines (websocket frames, outgoing messages
+    and so on) are limited to that many per second per kind.
+    """
+    logger = logging.getLogger()
+    handler = logging.StreamHandler(sys.stdout)
+
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+        handler.setLevel(logging.DEBUG)
+
+    handler.setFormatter(JSONFormatter() if json_format else logging.Formatter(LOG_FORMAT))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+    queue_handler.addFilter(ContextFilter())
+    sampler = None
+    if sample_rate:
+        sampler = SamplingFilter(sample_rate)
+        queue_handler.addFilter(sampler)
+    handler.addFilter(DropReporter(queue_handler, sampler))
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(
+        queue_handler.queue, handler, respect_handler_level=True,
+    )
+    listener.start()
+    # Write out whatever is still queued on exit.
+    atexit.register(listener.stop)
+    return logger
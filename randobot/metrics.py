@@ -0,0 +1,226 @@
+from bisect import bisect_left
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    )
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class for metrics. Each metric keeps one series per combination of
+    label values, or is given a function that is called for the current
+    value whenever metrics are rendered. If the metric has labels, the
+    function returns a dict of label values to value.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=(), function=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.function = function
+        self.series = {}
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def remove(self, **labels):
+        """
+        Forget the series with the given label values, e.g. when a race room
+        closes.
+        """
+        self.series.pop(self._key(labels), None)
+
+    def samples(self):
+        if self.function is None:
+            for key, value in self.series.items():
+                yield self.name, self.labels, key, value
+        elif self.labels:
+            for key, value in self.function().items():
+                yield self.name, self.labels, key, value
+        else:
+            yield self.name, (), (), self.function()
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.help),
+            '# TYPE %s %s' % (self.name, self.kind),
+        ]
+        for name, label_names, label_values, value in self.samples():
+            lines.append('%s%s %s' % (
+                name,
+                _format_labels(label_names, label_values),
+                _format_value(value),
+            ))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.series[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    default_buckets = (
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    )
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets or self.default_buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            # Per-bucket counts, then sum and count of observations.
+            series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        label_names = self.labels + ('le',)
+        for key, series in self.series.items():
+            total = 0
+            for bound, count in zip(self.buckets, series):
+                total += count
+                yield self.name + '_bucket', label_names, key + (_format_value(float(bound)),), total
+            yield self.name + '_sum', self.labels, key, series[-2]
+            yield self.name + '_count', self.labels, key, series[-1]
+
+
+class Metrics:
+    """
+    The bot's metrics, rendered in Prometheus text format.
+
+    Everything is a plain in-memory counter or histogram, so recording is a
+    dict update and costs nothing until metrics are scraped. Event loop lag
+    is recorded by the Watchdog.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.command_duration = self.add(Histogram(
+            'randobot_command_duration_seconds',
+            'Time taken to handle a chat command.',
+            labels=('command',),
+        ))
+        self.command_errors = self.add(Counter(
+            'randobot_command_errors_total',
+            'Chat commands that raised an exception.',
+            labels=('command',),
+        ))
+        self.outbound_messages = self.add(Counter(
+            'randobot_outbound_messages_total',
+            'Chat messages sent to a race room.',
+            labels=('race',),
+        ))
+        self.raceinfo_updates = self.add(Counter(
+            'randobot_raceinfo_updates_total',
+            'Race info updates sent to a race room.',
+            labels=('race',),
+        ))
+        self.zsr_duration = self.add(Histogram(
+            'randobot_zsr_request_duration_seconds',
+            'Time taken by requests to ootrandomizer.com and zeldaspeedruns.com.',
+            labels=('endpoint',),
+            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+        ))
+        self.zsr_errors = self.add(Counter(
+            'randobot_zsr_errors_total',
+            'Failed requests to ootrandomizer.com and zeldaspeedruns.com.',
+            labels=('endpoint',),
+        ))
+        self.race_list_polls = self.add(Counter(
+            'randobot_race_list_polls_total',
+            'Race list polls, by result (changed, not_modified, unchanged, rescanned or error).',
+            labels=('category', 'result'),
+        ))
+        self.loop_lag = self.add(Gauge(
+            'randobot_event_loop_lag_seconds',
+            'Most recently measured event loop lag.',
+        ))
+        self.loop_lag_histogram = self.add(Histogram(
+            'randobot_event_loop_lag_distribution_seconds',
+            'Distribution of measured event loop lag.',
+        ))
+        self._runner = None
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, function, labels=()):
+        """
+        Add a gauge whose value is read from a function when rendered.
+        """
+        return self.add(Gauge(name, help, labels=labels, function=function))
+
+    def counter(self, name, help, function, labels=()):
+        """
+        Add a counter whose value is read from a function when rendered, for
+        totals kept elsewhere.
+        """
+        return self.add(Counter(name, help, labels=labels, function=function))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+    def forget_race(self, race):
+        """
+        Drop per-room series for a race room that has closed.
+        """
+        self.outbound_messages.remove(race=race)
+        self.raceinfo_updates.remove(race=race)
+
+    async def handle_metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(
+            text=self.render(),
+            content_type='text/plain',
+            charset='utf-8',
+        )
+
+    async def serve(self, host, port):
+        """
+        Serve metrics over HTTP at /metrics.
+        """
+        # aiohttp.web is only needed with --metrics-port, and is slow to
+        # import, so it isn't imported at startup otherwise.
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
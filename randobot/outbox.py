@@ -0,0 +1,266 @@
+import asyncio
+import time
+from collections import deque
+
+from .watchdog import Load
+
+
+class Clock:
+    """
+    The time rate limits, pacing and dedupe windows go by: real time.
+    `randobot replay` substitutes a clock running in recorded time (see
+    replay.ReplayClock).
+    """
+    def monotonic(self):
+        return time.monotonic()
+
+    async def sleep(self, delay):
+        await asyncio.sleep(delay)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Holds up to `burst` tokens, refilled at `rate`
+    tokens per second.
+    """
+    def __init__(self, rate, burst, clock=None):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock or Clock()
+        self.tokens = burst
+        self.updated = self.clock.monotonic()
+
+    def _refill(self):
+        now = self.clock.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """
+        Take a token if one is available. Returns 0 on success, otherwise the
+        number of seconds until a token will be available.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        """
+        Wait until a token is available, then take it.
+        """
+        delay = self.take()
+        while delay:
+            await self.clock.sleep(delay)
+            delay = self.take()
+
+
+class Outbox:
+    """
+    Outbound queue for a single race room.
+
+    Handlers put chat messages and race info updates here and carry on
+    straight away. A background task sends them in order, paced by a token
+    bucket, and:
+    * joins consecutive queued chat messages into one message (up to
+      `max_length` characters), unless they were queued with coalesce=False.
+    * drops a queued race info update if a newer one arrives before it is
+      sent, since only the newest one would be visible anyway (unless the
+      queued one overwrites and the newer one doesn't).
+    * drops a chat message queued with dedupe=True if an identical one was
+      queued in the last `repeat_window` seconds, so a flood of commands
+      gets one refusal.
+    * holds back chat messages queued with essential=False while the
+      watchdog reports the bot is under load, and sends them once it
+      recovers (or drops them, if they are older than `defer_limit` by then
+      or the load is critical).
+    """
+    MESSAGE = 'message'
+    RACEINFO = 'raceinfo'
+
+    # Sends per second allowed, and how many may be sent in a quick burst.
+    rate = 1.0
+    burst = 5
+
+    # Longest chat message to produce when joining messages together.
+    max_length = 1000
+    separator = ' | '
+
+    repeat_window = 5
+
+    # Seconds a deferred, non-essential message stays worth sending.
+    defer_limit = 60
+
+    def __init__(self, send_message, send_raceinfo, logger, name=None,
+                 metrics=None, watchdog=None, clock=None):
+        self.send_message = send_message
+        self.send_raceinfo = send_raceinfo
+        self.logger = logger
+        self.name = name
+        self.metrics = metrics
+        self.watchdog = watchdog
+        self.clock = clock or Clock()
+        self.bucket = TokenBucket(self.rate, self.burst, self.clock)
+        self.queue = deque()
+        self.deferred = deque()
+        self.recent = {}
+        self.sent = 0
+        self.dropped = 0
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+
+    def start(self):
+        """
+        Start the background sending task.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        """
+        Stop the background sending task. Anything still queued is dropped,
+        use `flush` first to wait for it to be sent.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def flush(self):
+        """
+        Wait until everything queued so far has been sent.
+        """
+        if self._task is not None and not self._task.done():
+            await self._idle.wait()
+
+    def put_message(self, message, coalesce=True, dedupe=False, essential=True):
+        """
+        Queue a chat message. With dedupe, the message is dropped if it
+        repeats a recent one. Non-essential messages may be deferred or
+        dropped under load.
+        """
+        if not essential and self.watchdog and (
+            self.deferred or self.watchdog.level > Load.NORMAL
+        ):
+            if self.watchdog.level >= Load.CRITICAL:
+                self.dropped += 1
+            else:
+                self.deferred.append((self.clock.monotonic(), message, coalesce))
+            return
+        if not dedupe:
+            self._put((self.MESSAGE, message, coalesce))
+            return
+        now = self.clock.monotonic()
+        if now - self.recent.get(message, -self.repeat_window) < self.repeat_window:
+            self.dropped += 1
+            return
+        if len(self.recent) > 100:
+            self.recent = {
+                text: queued_at for text, queued_at in self.recent.items()
+                if now - queued_at < self.repeat_window
+            }
+        self.recent[message] = now
+        self._put((self.MESSAGE, message, coalesce))
+
+    def put_raceinfo(self, info, overwrite=False, prefix=True):
+        """
+        Queue a race info update, replacing any that has not been sent yet.
+        A pending update with overwrite=True is only replaced by another
+        with overwrite=True, so it isn't lost.
+        """
+        for item in list(self.queue):
+            if item[0] == self.RACEINFO and (overwrite or not item[2]):
+                self.queue.remove(item)
+                self.dropped += 1
+        self._put((self.RACEINFO, info, overwrite, prefix))
+
+    def _put(self, item):
+        self.queue.append(item)
+        self._idle.clear()
+        self._wakeup.set()
+
+    def _next_message(self, message):
+        """
+        Join any chat messages at the front of the queue onto the given one.
+        """
+        while self.queue:
+            item = self.queue[0]
+            if item[0] != self.MESSAGE or not item[2]:
+                break
+            joined = message + self.separator + item[1]
+            if len(joined) > self.max_length:
+                break
+            self.queue.popleft()
+            message = joined
+        return message
+
+    def _release_deferred(self):
+        """
+        Move deferred messages that are still fresh onto the queue.
+        """
+        now = self.clock.monotonic()
+        while self.deferred:
+            queued_at, message, coalesce = self.deferred.popleft()
+            if now - queued_at > self.defer_limit:
+                self.dropped += 1
+            else:
+                self.queue.append((self.MESSAGE, message, coalesce))
+
+    async def _wait(self):
+        """
+        Wait for something to be queued or, if messages are deferred, for
+        the load to return to normal.
+        """
+        if not self.deferred:
+            await self._wakeup.wait()
+            return
+        waiters = [
+            asyncio.ensure_future(self._wakeup.wait()),
+            asyncio.ensure_future(self.watchdog.normal.wait()),
+        ]
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _run(self):
+        while True:
+            if not self.queue and self.deferred and self.watchdog.level == Load.NORMAL:
+                self._release_deferred()
+            if not self.queue:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wait()
+                continue
+            await self.bucket.acquire()
+            if not self.queue:
+                continue
+            item = self.queue.popleft()
+            try:
+                if item[0] == self.MESSAGE:
+                    message = item[1]
+                    if item[2]:
+                        message = self._next_message(message)
+                    await self.send_message(message)
+                    if self.metrics:
+                        self.metrics.outbound_messages.inc(race=self.name)
+                else:
+                    await self.send_raceinfo(item[1], overwrite=item[2], prefix=item[3])
+                    if self.metrics:
+                        self.metrics.raceinfo_updates.inc(race=self.name)
+                self.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.logger.error(
+                    '[%(race)s] Unable to send queued %(type)s.'
+                    % {'race': self.name, 'type': item[0]},
+                    exc_info=True,
+                )
@@ -0,0 +1,131 @@
+import asyncio
+import time
+from collections import deque
+
+from .watchdog import Load
+from .zsr import ZSRError
+
+
+class SeedPool:
+    """
+    Pool of pre-rolled OoTR seeds, kept per (preset, encrypt) pair.
+
+    A background task keeps up to `size` ready seeds for each configured
+    pair, rolling at most `concurrency` at a time and discarding any older
+    than `max_age` seconds. `get` hands out a pooled seed if there is one and
+    only rolls a seed live when the pool is empty.
+    """
+    size = 2
+    max_age = 6 * 60 * 60
+    concurrency = 2
+
+    # Seconds between checks for expired seeds and missing entries.
+    refill_every = 60
+
+    def __init__(self, zsr, logger, targets=(), size=None, max_age=None,
+                 concurrency=None, watchdog=None):
+        self.zsr = zsr
+        self.logger = logger
+        self.watchdog = watchdog
+        if size is not None:
+            self.size = size
+        if max_age is not None:
+            self.max_age = max_age
+        if concurrency is not None:
+            self.concurrency = concurrency
+        self.seeds = {target: deque() for target in targets}
+        self.filling = {target: 0 for target in targets}
+        self.hits = 0
+        self.misses = 0
+        self._semaphore = None
+        self._wakeup = None
+        self._task = None
+
+    def stats(self):
+        """
+        Return a dict of pool counters.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'ready': sum(len(seeds) for seeds in self.seeds.values()),
+        }
+
+    def take(self, preset, encrypt):
+        """
+        Take a ready seed URL from the pool, or return None.
+        """
+        seeds = self.seeds.get((preset, encrypt))
+        if not seeds:
+            return None
+        expire_before = time.monotonic() - self.max_age
+        while seeds:
+            created, seed_uri = seeds.popleft()
+            if created >= expire_before:
+                return seed_uri
+        return None
+
+    async def get(self, preset, encrypt):
+        """
+        Return a seed URL for the given preset, from the pool if possible.
+        """
+        seed_uri = self.take(preset, encrypt)
+        if (preset, encrypt) in self.seeds:
+            if seed_uri:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if self._wakeup:
+                self._wakeup.set()
+        if seed_uri:
+            return seed_uri
+        return await self.zsr.roll_seed(preset, encrypt)
+
+    async def _fill(self, target):
+        try:
+            async with self._semaphore:
+                seed_uri = await self.zsr.roll_seed(*target)
+        except ZSRError:
+            self.logger.error(
+                'Unable to pre-roll a %(preset)s seed.' % {'preset': target[0]},
+                exc_info=True,
+            )
+        else:
+            self.seeds[target].append((time.monotonic(), seed_uri))
+        finally:
+            self.filling[target] -= 1
+
+    def refill(self):
+        """
+        Drop expired seeds and start rolling any that are missing. Rolling
+        is skipped while the bot is under critical load.
+        """
+        expire_before = time.monotonic() - self.max_age
+        paused = self.watchdog and self.watchdog.level >= Load.CRITICAL
+        for target, seeds in self.seeds.items():
+            while seeds and seeds[0][0] < expire_before:
+                seeds.popleft()
+            if paused:
+                continue
+            missing = self.size - len(seeds) - self.filling[target]
+            for _ in range(max(missing, 0)):
+                self.filling[target] += 1
+                asyncio.ensure_future(self._fill(target))
+
+    async def run(self):
+        """
+        Keep the pool topped up, forever.
+        """
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        while True:
+            self.refill()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.refill_every)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None and self.seeds:
+            self._task = asyncio.ensure_future(self.run())
@@ -0,0 +1,142 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+
+class Recording:
+    """
+    Traffic log for one race room connection, written as gzipped JSON lines.
+
+    Each line is [offset, kind, payload], with offset in seconds since the
+    connection was opened. Kinds:
+    * start - {"race": race data, "state": room state} as the handler starts.
+    * in - A frame received from racetime.gg, exactly as received.
+    * out - An action sent to racetime.gg, exactly as sent.
+    * seed - {"seed": seed, "reroll": reroll count} for every DWR seed
+      picked, so a replay can roll the same ones.
+    * end - {"state": room state} as the handler stops.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.started = time.monotonic()
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.dirty = False
+
+    def write(self, kind, payload):
+        self.file.write(json.dumps(
+            [round(time.monotonic() - self.started, 4), kind, payload],
+            separators=(',', ':'),
+        ) + '\n')
+        self.dirty = True
+
+    def flush(self):
+        if self.dirty:
+            self.file.flush()
+            self.dirty = False
+
+    def close(self):
+        self.file.close()
+
+
+class RecordingSocket:
+    """
+    Websocket wrapper that writes every frame sent or received to a
+    Recording. Anything else is passed through to the websocket.
+    """
+    def __init__(self, ws, recording):
+        self.ws = ws
+        self.recording = recording
+        self._messages = ws.__aiter__()
+
+    def __getattr__(self, name):
+        return getattr(self.ws, name)
+
+    async def send(self, message):
+        self.recording.write('out', message)
+        await self.ws.send(message)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._messages.__anext__()
+        self.recording.write('in', message)
+        return message
+
+
+class RecordingConnection:
+    """
+    Wraps the websocket connection given to a race handler, so the socket
+    it opens is a RecordingSocket.
+    """
+    def __init__(self, conn, recording):
+        self.conn = conn
+        self.recording = recording
+
+    async def __aenter__(self):
+        return RecordingSocket(await self.conn.__aenter__(), self.recording)
+
+    async def __aexit__(self, *exc_info):
+        return await self.conn.__aexit__(*exc_info)
+
+
+class Recorder:
+    """
+    Records race room traffic to a directory, one file per connection to a
+    room, for `randobot replay`.
+
+    Frames are compressed as they are written, and open recordings are
+    flushed every `flush_interval` seconds rather than per frame, so
+    recording costs little per frame and a crash loses at most the last
+    second of traffic.
+    """
+    flush_interval = 1
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.recordings = set()
+        self._task = None
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, race_name):
+        """
+        Start a new Recording for a race room.
+        """
+        recording = Recording(os.path.join(
+            self.directory,
+            '%(race)s-%(time)d.jsonl.gz' % {
+                'race': race_name.replace('/', '_'),
+                'time': time.time() * 1000,
+            },
+        ))
+        self.recordings.add(recording)
+        return recording
+
+    def close(self, recording):
+        """
+        Finish a Recording.
+        """
+        self.recordings.discard(recording)
+        recording.close()
+
+    async def run(self):
+        """
+        Flush open recordings every `flush_interval` seconds, forever.
+        """
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for recording in self.recordings:
+                recording.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for recording in list(self.recordings):
+            self.close(recording)
@@ -0,0 +1,125 @@
+import json
+import os
+
+DEFAULT_COMMANDS_PATH = os.path.join(os.path.dirname(__file__), 'commands.json')
+
+
+class PresetCommand:
+    """
+    A seed-rolling command defined in the command registry.
+
+    Attributes:
+    * name - Command name, without the "!" prefix.
+    * flags - Flagstring to roll with, or None to take flags from the
+      command's first argument.
+    * version - Randomizer version to set, if any.
+    * build_type - Build type to set alongside the version, if any.
+    * keep_version - Only set version/build type if the room has none yet.
+    * goals - Goal names the command may be used in (None for any).
+    * exclude_goals - Goal names the command may not be used in.
+    * goal_error - Message sent when used in the wrong goal.
+    * announce - Message sent before rolling, if any.
+    * description - Human-readable description of the command.
+    """
+    __slots__ = (
+        'name', 'flags', 'version', 'build_type', 'keep_version', 'goals',
+        'exclude_goals', 'goal_error', 'announce', 'description',
+    )
+
+    def __init__(self, name, flags=None, version=None, build_type=None,
+                 keep_version=False, goals=None, exclude_goals=None,
+                 goal_error=None, announce=None, description=None):
+        self.name = name
+        self.flags = flags
+        self.version = version
+        self.build_type = build_type
+        self.keep_version = keep_version
+        self.goals = frozenset(goals) if goals is not None else None
+        self.exclude_goals = frozenset(exclude_goals or ())
+        self.goal_error = goal_error or 'This command does not work in this category goal'
+        self.announce = announce
+        self.description = description
+
+    def allows_goal(self, goal_name):
+        """
+        Determine if this command may be used in a race with the given goal.
+        """
+        if goal_name in self.exclude_goals:
+            return False
+        return self.goals is None or goal_name in self.goals
+
+
+class CommandRegistry:
+    """
+    Registry of seed-rolling commands, loaded from a JSON file.
+
+    The file maps command names to their definitions (see `PresetCommand` for
+    the available keys). A definition of the form {"alias": "other"} makes
+    the command an alias of another one.
+
+    The registry is compiled into a dict on load, so looking up a command is a
+    single dict access. `reload` swaps the dict in one go, so handlers
+    holding this registry pick up the new definitions immediately.
+    """
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_COMMANDS_PATH
+        self.commands = {}
+        self.load()
+
+    def get(self, name):
+        """
+        Return the PresetCommand with the given name, or None.
+        """
+        return self.commands.get(name)
+
+    def load(self):
+        """
+        Load and compile the registry file. If the file is invalid, the
+        error is raised and the current commands are left in place.
+        """
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.commands = self.compile(data)
+
+    def reload(self, logger):
+        """
+        Reload the registry file, logging (rather than raising) any errors.
+        """
+        try:
+            self.load()
+        except (OSError, ValueError, TypeError):
+            logger.error(
+                'Unable to reload commands from %(path)s, keeping the old ones.'
+                % {'path': self.path},
+                exc_info=True,
+            )
+        else:
+            logger.info(
+                'Reloaded %(count)d commands from %(path)s'
+                % {'count': len(self.commands), 'path': self.path}
+            )
+
+    @staticmethod
+    def compile(data):
+        """
+        Compile raw registry data into a dict of command name to
+        PresetCommand.
+        """
+        if not isinstance(data, dict):
+            raise ValueError('Command registry must be a JSON object.')
+        commands = {}
+        aliases = {}
+        for name, definition in data.items():
+            name = name.lower()
+            if 'alias' in definition:
+                aliases[name] = definition['alias'].lower()
+            else:
+                commands[name] = PresetCommand(name, **definition)
+        for name, target in aliases.items():
+            if target not in commands:
+                raise ValueError(
+                    'Command "%(name)s" is an alias of unknown command "%(target)s".'
+                    % {'name': name, 'target': target}
+                )
+            commands[name] = commands[target]
+        return commands
@@ -0,0 +1,483 @@
+"""
+Replay race room traffic recorded with --record through RandoHandler,
+offline, and report where the replay differs from what was recorded.
+
+    randobot replay recordings/
+    randobot replay recordings/dwr_clever-slime-1234-*.jsonl.gz --speed 100
+    randobot replay recordings/ --speed max --json
+
+Every recording is replayed at once, as the rooms ran on the night. Frames
+are fed to the handler on their recorded schedule, sped up by --speed, and
+whatever the handler sends is collected instead of going to racetime.gg.
+Rate limits, message pacing and dedupe windows run in recorded time, so
+they behave as they did live at any speed.
+DWR seeds are taken from the recording, so rolls replay exactly. A
+recording cut short (with no end record) is only compared as far as it
+goes. Exits with status 1 if any recording replayed differently.
+"""
+import argparse
+import asyncio
+import collections
+import glob
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+from .handler import RandoHandler
+from .logs import LOG_FORMAT
+from .outbox import Clock, Outbox
+from .registry import CommandRegistry
+from .state import RoomState
+from .versions import VersionCatalog
+
+
+def read_recording(path):
+    """
+    Read a recording into a dict of its start and end records, frames
+    received, actions sent and seeds rolled. A recording cut short (e.g. by
+    a crash or the process being killed) is read up to where it stops, and
+    marked as truncated.
+
+    Raises OSError if the file can't be read.
+    """
+    recording = {
+        'path': path,
+        'start': None,
+        'end': None,
+        'truncated': False,
+        'frames': [],
+        'actions': [],
+        'seeds': [],
+    }
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                offset, kind, payload = json.loads(line)
+                if kind == 'in':
+                    recording['frames'].append((offset, payload))
+                elif kind == 'out':
+                    recording['actions'].append((offset, payload))
+                elif kind == 'seed':
+                    recording['seeds'].append(payload)
+                elif kind in ('start', 'end'):
+                    recording[kind] = payload
+    except (EOFError, ValueError):
+        pass
+    # Without an end record, the bot may have sent more than was written.
+    recording['truncated'] = recording['end'] is None
+    return recording
+
+
+def find_recordings(paths):
+    """
+    Expand directories in a list of paths into the recordings they hold.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, '*.jsonl.gz')))
+        else:
+            yield path
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def latencies(frames, actions):
+    """
+    Return, for each action, the seconds since the last frame received
+    before it.
+    """
+    received = [offset for offset, _ in frames]
+    result = []
+    i = 0
+    last = None
+    for offset, _ in actions:
+        while i < len(received) and received[i] <= offset:
+            last = received[i]
+            i += 1
+        if last is not None:
+            result.append(offset - last)
+    return result
+
+
+def normalize(actions):
+    """
+    Split sent actions into the chat messages sent (with messages the outbox
+    joined together split apart again, since how they are joined depends on
+    timing), race info updates, and anything else.
+    """
+    messages, infos, other = [], [], []
+    for _, raw in actions:
+        action = json.loads(raw)
+        data = dict(action.get('data') or {})
+        data.pop('guid', None)
+        if action.get('action') == 'message':
+            messages.extend(data.get('message', '').split(Outbox.separator))
+        elif action.get('action') == 'setinfo':
+            infos.append(data.get('info_user', data.get('info_bot')))
+        else:
+            other.append([action.get('action'), data])
+    return messages, infos, other
+
+
+class ReplayClock(Clock):
+    """
+    Clock for a replayed room's rate limits and pacing, in recorded seconds.
+
+    With a speed, recorded time runs `speed` times faster than real time.
+    Without one (replaying as fast as possible), time only moves when the
+    replay moves it: `advance` wakes sleepers in the order they are due,
+    and the clock jumps to each one's wake time, then to the next frame's.
+    """
+    def __init__(self, speed=None):
+        self.speed = speed
+        self.started = time.monotonic()
+        self.now = 0.0
+        self.sleepers = []
+        self._order = itertools.count()
+
+    def monotonic(self):
+        if self.speed:
+            return (time.monotonic() - self.started) * self.speed
+        return self.now
+
+    async def sleep(self, delay):
+        if self.speed:
+            await asyncio.sleep(delay / self.speed)
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        # Always move time on a little, as real time would, or rounding can
+        # leave a token bucket waiting forever for the last sliver of a
+        # token.
+        wake = self.now + max(delay, 1e-6)
+        heapq.heappush(self.sleepers, (wake, next(self._order), waiter))
+        await waiter
+
+    async def advance(self, until=None):
+        """
+        Wake every sleeper due by `until` (or all of them, if None), letting
+        each run before the next, then move the clock on to `until`.
+        """
+        while self.sleepers and (until is None or self.sleepers[0][0] <= until):
+            wake, _, waiter = heapq.heappop(self.sleepers)
+            self.now = max(self.now, wake)
+            if not waiter.done():
+                waiter.set_result(None)
+                await asyncio.sleep(0)
+        if until is not None:
+            self.now = max(self.now, until)
+        await asyncio.sleep(0)
+
+    async def run_until(self, awaitable):
+        """
+        Wait for something that may be waiting on the clock (e.g. an outbox
+        flush), moving time on for as long as it takes.
+        """
+        task = asyncio.ensure_future(awaitable)
+        while not task.done():
+            await self.advance()
+        return task.result()
+
+
+class StubConnection:
+    """
+    Stands in for the websocket connection given to a race handler. Yields
+    recorded frames on their recorded schedule (divided by `speed`, or as
+    fast as the handler takes them if speed is None) and collects whatever
+    is sent.
+
+    As fast as possible, frames recorded less than `burst_gap` seconds
+    apart are fed back to back, as they arrived in one read from the socket
+    live. Between bursts the handler is given time to catch up (`settle`)
+    and the clock moves on to the next frame.
+    """
+    burst_gap = 0.001
+
+    def __init__(self, frames, speed=None, clock=None):
+        self.frames = frames
+        self.speed = speed
+        self.clock = clock or ReplayClock(speed)
+        self.received = []
+        self.sent = []
+        self.started = None
+        # Called between bursts of frames when replaying as fast as
+        # possible, and after the last frame, before the "connection"
+        # closes.
+        self.settle = None
+        self.drain = None
+
+    async def __aenter__(self):
+        self.started = time.monotonic()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    async def send(self, message):
+        self.sent.append((self.elapsed(), message))
+
+    def __aiter__(self):
+        return self.receive()
+
+    async def receive(self):
+        previous = None
+        for offset, message in self.frames:
+            if self.speed:
+                delay = offset / self.speed - self.elapsed()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif previous is None or offset - previous >= self.burst_gap:
+                await asyncio.sleep(0)
+                if self.settle:
+                    await self.settle()
+                await self.clock.advance(offset)
+            previous = offset
+            self.received.append((self.elapsed(), message))
+            yield message
+        if self.drain:
+            await self.drain()
+
+
+class ReplayHandler(RandoHandler):
+    """
+    RandoHandler that rolls the recorded seeds rather than new ones, and
+    runs on a ReplayClock.
+    """
+    def __init__(self, seeds=(), **kwargs):
+        super().__init__(**kwargs)
+        self.seeds = collections.deque(seeds)
+
+    async def end(self):
+        # Ending waits for the outbox, which (replaying as fast as possible)
+        # only sends while something moves the clock on.
+        clock = self.outbox.clock
+        if clock.speed:
+            await super().end()
+        else:
+            await clock.run_until(super().end())
+
+    def new_seed(self):
+        seed = super().new_seed()
+        if self.seeds:
+            recorded = self.seeds.popleft()
+            self.state.reroll = recorded['reroll']
+            seed = recorded['seed']
+        return seed
+
+
+class Replayer:
+    """
+    Replays recordings and compares the results with what was recorded.
+    """
+    def __init__(self, catalog, registry, logger, speed=None):
+        self.catalog = catalog
+        self.registry = registry
+        self.logger = logger
+        self.speed = speed
+
+    async def replay(self, recording):
+        """
+        Replay one recording, returning a report dict.
+        """
+        start = recording['start'] or {}
+        clock = ReplayClock(self.speed)
+        conn = StubConnection(recording['frames'], self.speed, clock)
+        handler = ReplayHandler(
+            seeds=recording['seeds'],
+            clock=clock,
+            catalog=self.catalog,
+            registry=self.registry,
+            logger=self.logger,
+            conn=conn,
+            state=RoomState.from_dict(start.get('state') or {}),
+        )
+        handler.data = start.get('race') or {}
+
+        async def drain():
+            await handler.commands.join()
+            if self.speed:
+                await handler.outbox.flush()
+            else:
+                await clock.run_until(handler.outbox.flush())
+
+        conn.settle = handler.commands.join
+        conn.drain = drain
+        error = None
+        started = time.perf_counter()
+        try:
+            await handler.handle()
+        except Exception as e:
+            self.logger.error('Replay raised exception.', exc_info=True)
+            error = repr(e)
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'recording': recording['path'],
+            'race': handler.data.get('name'),
+            'frames': len(recording['frames']),
+            'actions_recorded': len(recording['actions']),
+            'actions_replayed': len(conn.sent),
+            'truncated': recording['truncated'],
+            'replay_seconds': round(elapsed, 3),
+            'mismatches': self.compare(recording, handler, conn),
+        }
+        if error:
+            report['mismatches'].insert(0, 'replay raised %s' % error)
+        for name, frames, actions in (
+            ('recorded', recording['frames'], recording['actions']),
+            ('replayed', conn.received, conn.sent),
+        ):
+            values = latencies(frames, actions)
+            for label, q in (('p50', 0.5), ('max', 1.0)):
+                value = percentile(values, q)
+                report['latency_%s_%s_ms' % (name, label)] = (
+                    round(value * 1000, 2) if value is not None else None
+                )
+        return report
+
+    def compare(self, recording, handler, conn):
+        """
+        Return a list of differences between the recorded and replayed
+        actions and final room state.
+
+        A truncated recording stops before the room did, so only what it
+        holds is compared: the replay may send more, and there is no final
+        state to compare.
+        """
+        mismatches = []
+        recorded = normalize(recording['actions'])
+        replayed = normalize(conn.sent)
+        if recording['truncated']:
+            messages, infos, other = replayed
+            if recorded[1] and recorded[1][-1] in infos:
+                # Updates after the last recorded one were lost.
+                infos = infos[:infos.index(recorded[1][-1]) + 1]
+            replayed = messages[:len(recorded[0])], infos, other[:len(recorded[2])]
+
+        for index, (old, new) in enumerate(zip(recorded[0], replayed[0])):
+            if old != new:
+                mismatches.append(
+                    'message %d: recorded %r, replayed %r' % (index + 1, old, new)
+                )
+                break
+        if len(recorded[0]) != len(replayed[0]):
+            mismatches.append(
+                'recorded %d messages, replayed %d'
+                % (len(recorded[0]), len(replayed[0]))
+            )
+        # Race info updates supersede each other, so only the last counts.
+        old_info = recorded[1][-1] if recorded[1] else None
+        new_info = replayed[1][-1] if replayed[1] else None
+        if old_info != new_info:
+            mismatches.append(
+                'race info: recorded %r, replayed %r' % (old_info, new_info)
+            )
+        if recorded[2] != replayed[2]:
+            mismatches.append(
+                'other actions: recorded %r, replayed %r' % (recorded[2], replayed[2])
+            )
+        if recording['end']:
+            old_state = recording['end']['state']
+            new_state = handler.state.to_dict()
+            for key in sorted(set(old_state) | set(new_state)):
+                if old_state.get(key) != new_state.get(key):
+                    mismatches.append(
+                        'state %s: recorded %r, replayed %r'
+                        % (key, old_state.get(key), new_state.get(key))
+                    )
+        return mismatches
+
+    async def run(self, recordings):
+        return await asyncio.gather(*(
+            self.replay(recording) for recording in recordings
+        ))
+
+
+def print_report(report):
+    print('%(race)s (%(recording)s): %(result)s, %(frames)d frames, '
+          '%(actions_recorded)d -> %(actions_replayed)d actions, '
+          'latency p50 %(p50_old)s -> %(p50_new)s ms, max %(max_old)s -> %(max_new)s ms' % {
+              'race': report['race'],
+              'recording': report['recording'],
+              'result': ('MISMATCH' if report['mismatches'] else 'ok') + (
+                  ' (truncated)' if report['truncated'] else ''
+              ),
+              'frames': report['frames'],
+              'actions_recorded': report['actions_recorded'],
+              'actions_replayed': report['actions_replayed'],
+              'p50_old': report['latency_recorded_p50_ms'],
+              'p50_new': report['latency_replayed_p50_ms'],
+              'max_old': report['latency_recorded_max_ms'],
+              'max_new': report['latency_replayed_max_ms'],
+          })
+    if report['truncated']:
+        print('    recording has no end record (the bot was stopped or '
+              'crashed), so it was only compared up to where it stops')
+    for mismatch in report['mismatches']:
+        print('    ' + mismatch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='randobot replay',
+        description='Replay recorded race room traffic through RandoHandler.',
+    )
+    parser.add_argument('recordings', type=str, nargs='+', help='recording files, or directories of them')
+    parser.add_argument('--speed', type=str, default='1', help='replay speed factor, e.g. 1 or 100, or "max" for as fast as possible (default: 1)')
+    parser.add_argument('--commands', type=str, help='command registry JSON file')
+    parser.add_argument('--versions-cache', type=str, help='version catalog snapshot to use instead of the bundled one')
+    parser.add_argument('--json', action='store_true', help='print one JSON report per recording')
+    parser.add_argument('--verbose', '-v', action='store_true', help='log what the handlers do')
+    args = parser.parse_args(argv)
+
+    if args.speed == 'max':
+        speed = None
+    else:
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            parser.error('--speed must be a number or "max"')
+        if speed <= 0:
+            parser.error('--speed must be positive')
+
+    logging.basicConfig(
+        stream=sys.stderr,
+        format=LOG_FORMAT,
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+    )
+    recordings = []
+    for path in find_recordings(args.recordings):
+        if not os.path.exists(path):
+            parser.error('no such recording: %s' % path)
+        try:
+            recordings.append(read_recording(path))
+        except OSError as e:
+            parser.error('can\'t read %s: %s' % (path, e))
+    if not recordings:
+        parser.error('no recordings found')
+
+    replayer = Replayer(
+        catalog=VersionCatalog(snapshot_path=args.versions_cache),
+        registry=CommandRegistry(args.commands),
+        logger=logging.getLogger('randobot.replay'),
+        speed=speed,
+    )
+    reports = asyncio.run(replayer.run(recordings))
+    for report in reports:
+        if args.json:
+            print(json.dumps(report))
+        else:
+            print_report(report)
+    return 1 if any(report['mismatches'] for report in reports) else 0
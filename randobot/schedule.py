@@ -0,0 +1,143 @@
+import json
+import random
+import time
+from datetime import datetime, timezone
+from fnmatch import fnmatchcase
+
+
+def parse_time(value):
+    """
+    Parse an ISO 8601 timestamp (as used by racetime.gg) into a Unix time.
+    Timestamps without a timezone are taken to be UTC.
+    """
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class ScheduleEntry:
+    """
+    A seed to roll automatically when the bot joins a matching race room.
+
+    Attributes:
+    * race - Pattern the race name must match (e.g. "dwr/*"), or None.
+    * starts_at - Unix time the race starts, or None. The room must have been
+      opened within `window` seconds before it.
+    * window - See starts_at.
+    * command - Registry command to roll with, or None.
+    * preset - OoTR preset to roll, if there is no command.
+    * encrypt - Roll OoTR seeds without a spoiler log.
+    * lead - Without starts_at, the roll happens within this many seconds of
+      joining the room.
+    """
+    __slots__ = (
+        'race', 'starts_at', 'window', 'command', 'preset', 'encrypt', 'lead',
+    )
+
+    def __init__(self, race=None, starts_at=None, window=3600, command=None,
+                 preset=None, spoiler=False, lead=60):
+        if not race and not starts_at:
+            raise ValueError('Schedule entries need a race pattern or starts_at.')
+        if not command and not preset:
+            raise ValueError('Schedule entries need a command or preset.')
+        self.race = race
+        self.starts_at = parse_time(starts_at) if starts_at else None
+        self.window = window
+        self.command = command.lower() if command else None
+        self.preset = preset
+        self.encrypt = not spoiler
+        self.lead = lead
+
+    def matches(self, race_data):
+        if self.race and not fnmatchcase(race_data.get('name') or '', self.race):
+            return False
+        if self.starts_at is not None:
+            opened_at = race_data.get('opened_at')
+            if not opened_at:
+                return False
+            opened = parse_time(opened_at)
+            if not self.starts_at - self.window <= opened <= self.starts_at:
+                return False
+        return True
+
+
+class Schedule:
+    """
+    Schedule of automatic seed rolls, loaded from a JSON file holding a list
+    of entries (see `ScheduleEntry` for the available keys).
+
+    When the bot joins a room, `plan` finds the first matching entry and
+    picks a time to roll at: a random point between now and `margin` seconds
+    before the race starts, or within the entry's `lead` seconds if it has
+    no start time. Spreading the rolls out this way keeps a batch of league
+    rooms opening together from rolling all at once.
+    """
+    # Seconds before the start time by which every scheduled roll is done.
+    margin = 120
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.load()
+
+    def load(self):
+        """
+        Load the schedule file. If the file is invalid, the error is raised
+        and the current entries are left in place.
+        """
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise ValueError('Schedule must be a JSON list.')
+        self.entries = [ScheduleEntry(**entry) for entry in data]
+
+    def reload(self, logger):
+        """
+        Reload the schedule file, logging (rather than raising) any errors.
+        """
+        try:
+            self.load()
+        except (OSError, ValueError, TypeError):
+            logger.error(
+                'Unable to reload schedule from %(path)s, keeping the old one.'
+                % {'path': self.path},
+                exc_info=True,
+            )
+        else:
+            logger.info(
+                'Reloaded %(count)d schedule entries from %(path)s'
+                % {'count': len(self.entries), 'path': self.path}
+            )
+
+    def match(self, race_data):
+        """
+        Return the first entry matching a race, or None.
+        """
+        for entry in self.entries:
+            if entry.matches(race_data):
+                return entry
+        return None
+
+    def plan(self, race_data, now=None):
+        """
+        Return a job (a dict, stored in the room's state) for the first
+        entry matching a race, or None.
+        """
+        entry = self.match(race_data)
+        if not entry:
+            return None
+        now = now or time.time()
+        if entry.starts_at is not None:
+            latest = max(now, entry.starts_at - self.margin)
+        else:
+            latest = now + entry.lead
+        return {
+            'command': entry.command,
+            'preset': entry.preset,
+            'encrypt': entry.encrypt,
+            'due': random.uniform(now, latest),
+            'latest': latest,
+        }
@@ -0,0 +1,41 @@
+import hashlib
+import hmac
+
+# DWR seeds are 13 digits long.
+SEED_MIN = 1_000_000_000_000
+SEED_MAX = 9_999_999_999_999
+
+
+def derive_seed(secret, race_name, reroll=0):
+    """
+    Derive the seed for a race room from a server secret, the race name
+    (e.g. "dwr/clever-slime-1234") and the number of seeds already rolled in
+    the room.
+
+    The result is an HMAC-SHA256 of the race name and reroll counter, reduced
+    to the range SEED_MIN..SEED_MAX (inclusive). The same inputs always give
+    the same seed, so any process holding the secret can recompute a room's
+    seed without stored state, while nobody without it can predict or choose
+    one.
+    """
+    if isinstance(secret, str):
+        secret = secret.encode('utf-8')
+    digest = hmac.new(
+        secret,
+        ('%s#%d' % (race_name, reroll)).encode('utf-8'),
+        hashlib.sha256,
+    ).digest()
+    # 256 bits reduced modulo ~2^33: the bias is far too small to matter.
+    return SEED_MIN + int.from_bytes(digest, 'big') % (SEED_MAX - SEED_MIN + 1)
+
+
+def find_reroll(secret, race_name, seed, limit=100):
+    """
+    Return the reroll counter that derives the given seed for a race, or
+    None if none of the first `limit` do.
+    """
+    for reroll in range(limit):
+        if derive_seed(secret, race_name, reroll) == seed:
+            return reroll
+    return None
+
@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import multiprocessing
+import signal
+from bisect import bisect
+
+from .bot import RandoBot, run_bots
+from .logs import configure_logging
+from .shared import SharedResources
+from .state import RoomState
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping race names to worker indexes.
+
+    Each worker is placed on the ring at `replicas` points, so removing a
+    worker only moves the races that hashed to it.
+    """
+    replicas = 64
+
+    def __init__(self, workers=()):
+        self.points = []
+        self.owners = {}
+        for worker in workers:
+            self.add(worker)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, worker):
+        for replica in range(self.replicas):
+            point = self._hash('%s#%d' % (worker, replica))
+            self.owners[point] = worker
+            self.points.insert(bisect(self.points, point), point)
+
+    def remove(self, worker):
+        self.points = [point for point in self.points if self.owners[point] != worker]
+        self.owners = {point: self.owners[point] for point in self.points}
+
+    def __len__(self):
+        return len(set(self.owners.values()))
+
+    def get(self, key):
+        """
+        Return the worker responsible for the given key.
+        """
+        if not self.points:
+            raise LookupError('No workers available.')
+        index = bisect(self.points, self._hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
+
+
+class WorkerBot(RandoBot):
+    """
+    Bot running in a worker process. Instead of polling the category race
+    list it joins races handed to it by the supervisor, and reports back
+    when it stops handling them.
+    """
+    polls_races = False
+
+    def __init__(self, *args, conn, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.conn = conn
+        # Races handed over by the supervisor whose state is being loaded.
+        self.joining = set()
+
+    def start(self):
+        self.loop.create_task(self.reauthorize())
+
+    async def join_assigned(self, race_data):
+        """
+        Join a race handed over by the supervisor. Its state is read from the
+        state store first, as the room may have been handled (and a seed
+        rolled) by another worker since this one started.
+        """
+        name = race_data.get('name')
+        self.joining.add(name)
+        try:
+            if self.store:
+                stored = await self.loop.run_in_executor(None, self.store.load, name)
+                if stored is None:
+                    self.state.pop(name, None)
+                else:
+                    self.state[name] = RoomState.from_dict(stored)
+        finally:
+            self.joining.discard(name)
+        if name in self.handlers:
+            return
+        if self.shared.at_capacity():
+            # Hand the race back, so the supervisor offers it again later.
+            self.logger.warning(
+                'Not joining %(race)s: already handling %(max)d rooms.'
+                % {'race': name, 'max': self.shared.max_rooms}
+            )
+            self.report_done(name)
+            return
+        self.join_race(race_data)
+
+    def race_done(self, name, task):
+        super().race_done(name, task)
+        self.report_done(name)
+
+    def report_done(self, name):
+        """
+        Tell the supervisor this worker isn't handling a race (any more).
+        """
+        try:
+            self.conn.send(('done', self.category_slug, name))
+        except (BrokenPipeError, OSError):
+            pass
+
+
+def worker_main(index, conn, config):
+    """
+    Entry point for worker processes.
+    """
+    # Shutdown is the supervisor's job.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger = configure_logging(**config['logging'])
+    RandoBot.racetime_host = config['racetime_host']
+    RandoBot.racetime_secure = config['racetime_secure']
+    shared_kwargs = dict(config['shared'])
+    # Every worker serves its own metrics and admin API, on consecutive ports
+    # (or its own Unix socket).
+    if shared_kwargs.get('metrics_port'):
+        shared_kwargs['metrics_port'] += index
+    if shared_kwargs.get('admin_port'):
+        shared_kwargs['admin_port'] += index
+    if shared_kwargs.get('admin_socket'):
+        shared_kwargs['admin_socket'] += '.%d' % index
+    shared = SharedResources(logger=logger, **shared_kwargs)
+    bots = {
+        category['category_slug']: WorkerBot(
+            commands_path=category.get('commands'),
+            shared=shared,
+            conn=conn,
+            category_slug=category['category_slug'],
+            client_id=category['client_id'],
+            client_secret=category['client_secret'],
+            logger=logger,
+        )
+        for category in config['categories']
+    }
+    loop = next(iter(bots.values())).loop
+
+    def receive():
+        try:
+            command, category_slug, race_data = conn.recv()
+        except EOFError:
+            # The supervisor has gone away.
+            loop.stop()
+            return
+        bot = bots[category_slug]
+        name = race_data.get('name')
+        if command != 'join' or name in bot.handlers or name in bot.joining:
+            return
+        loop.create_task(bot.join_assigned(race_data))
+
+    def ready():
+        # Races are only read once the bots have access tokens; until then
+        # they wait in the pipe.
+        loop.add_reader(conn.fileno(), receive)
+        logger.info('Worker %(index)d started.' % {'index': index})
+
+    # The supervisor stops workers with SIGTERM.
+    run_bots(list(bots.values()), ready=ready, stop_signals=(signal.SIGTERM,))
+
+
+class CoordinatorBot(RandoBot):
+    """
+    Bot that polls a category's race list on behalf of the supervisor, and
+    assigns new races to workers rather than handling them itself.
+
+    `handlers` maps each assigned race name to its worker's index. The race
+    list needs no authorization, so it never gets an access token.
+    """
+    needs_token = False
+
+    def __init__(self, *args, supervisor, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.supervisor = supervisor
+
+    def assign_race(self, race_data):
+        name = race_data.get('name')
+        worker = self.supervisor.ring.get(name)
+        self.handlers[name] = worker
+        self.supervisor.send(worker, ('join', self.category_slug, race_data))
+        self.logger.info(
+            'Assigned %(race)s to worker %(worker)d'
+            % {'race': name, 'worker': worker}
+        )
+
+    async def scan_races(self):
+        scanned = await super().scan_races()
+        # Forget races that have left the category.
+        for name in list(self.handlers):
+            if name not in self.races:
+                del self.handlers[name]
+        return scanned
+
+    def release(self, worker):
+        """
+        Forget every race assigned to a worker, so the next scan hands them
+        to someone else. Returns the number of races released.
+        """
+        names = [name for name, owner in self.handlers.items() if owner == worker]
+        for name in names:
+            del self.handlers[name]
+        return len(names)
+
+
+class Supervisor:
+    """
+    Runs the bot as several worker processes.
+
+    Each worker is a full bot process (with its own event loop and
+    connections) that only handles the race rooms it is given. The
+    supervisor polls each category's race list and assigns every new race to
+    a worker by consistent hashing of the race name, remembering the
+    assignment so a room is never joined twice.
+
+    If a worker dies, its races are released and reassigned to the
+    surviving workers at once, then a replacement worker is started to take
+    a share of new races.
+    """
+    check_workers_every = 1
+
+    def __init__(self, workers, categories, shared_kwargs, logger, logging_kwargs=None):
+        self.workers = workers
+        self.categories = categories
+        self.logger = logger
+        self.config = {
+            'categories': categories,
+            'shared': shared_kwargs,
+            'logging': logging_kwargs or {},
+            'racetime_host': RandoBot.racetime_host,
+            'racetime_secure': RandoBot.racetime_secure,
+        }
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = {}
+        self.conns = {}
+        self.ring = HashRing()
+        self.coordinators = []
+        self.loop = asyncio.get_event_loop()
+
+    def spawn(self, index):
+        """
+        Start (or restart) the worker with the given index.
+        """
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=worker_main,
+            args=(index, child_conn, self.config),
+            name='randobot-worker-%d' % index,
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self.processes[index] = process
+        self.conns[index] = parent_conn
+        self.loop.add_reader(parent_conn.fileno(), self.receive, index)
+        self.ring.add(index)
+
+    def send(self, worker, message):
+        try:
+            self.conns[worker].send(message)
+        except (BrokenPipeError, OSError):
+            # The worker is dying; check_workers will reassign its races.
+            pass
+
+    def receive(self, index):
+        conn = self.conns[index]
+        try:
+            command, category_slug, name = conn.recv()
+        except (EOFError, OSError):
+            self.loop.remove_reader(conn.fileno())
+            return
+        if command == 'done':
+            for coordinator in self.coordinators:
+                if (
+                    coordinator.category_slug == category_slug
+                    and coordinator.handlers.get(name) == index
+                ):
+                    # Allow the race to be picked up again on the next scan,
+                    # if it is still open.
+                    del coordinator.handlers[name]
+
+    def worker_died(self, index):
+        process = self.processes.pop(index)
+        conn = self.conns.pop(index)
+        try:
+            self.loop.remove_reader(conn.fileno())
+        except (ValueError, OSError):
+            pass
+        conn.close()
+        self.ring.remove(index)
+        released = sum(coordinator.release(index) for coordinator in self.coordinators)
+        self.logger.error(
+            'Worker %(index)d exited with code %(code)s, moving %(count)d races.'
+            % {'index': index, 'code': process.exitcode, 'count': released}
+        )
+
+    async def check_workers(self):
+        while True:
+            await asyncio.sleep(self.check_workers_every)
+            dead = [index for index, process in self.processes.items() if not process.is_alive()]
+            if not dead:
+                continue
+            for index in dead:
+                self.worker_died(index)
+            if len(self.ring):
+                # Move the dead workers' races before their replacements
+                # join the ring, so they go to the survivors.
+                await asyncio.gather(*(
+                    coordinator.scan_races() for coordinator in self.coordinators
+                ))
+            for index in dead:
+                self.spawn(index)
+
+    def run(self):
+        for index in range(self.workers):
+            self.spawn(index)
+        # The supervisor only needs to poll, so it doesn't share any of the
+        # workers' resources.
+        shared = SharedResources(self.logger)
+        self.coordinators = [
+            CoordinatorBot(
+                supervisor=self,
+                shared=shared,
+                category_slug=category['category_slug'],
+                client_id=category['client_id'],
+                client_secret=category['client_secret'],
+                logger=self.logger,
+            )
+            for category in self.categories
+        ]
+        self.loop.create_task(self.check_workers())
+        try:
+            run_bots(self.coordinators)
+        finally:
+            for process in self.processes.values():
+                process.terminate()
+            for process in self.processes.values():
+                process.join(5)
@@ -0,0 +1,193 @@
+import asyncio
+import time
+
+from .metrics import Metrics
+from .versions import VersionCatalog
+from .watchdog import Watchdog
+
+
+class SharedResources:
+    """
+    Resources shared by every RandoBot in the process, whatever category it
+    serves: the metrics surface, load watchdog, version catalog, state
+    store, ZSR client (and so its HTTP connection pool and preset cache),
+    seed pool, seed secret, roll schedule, traffic recorder and admin API.
+
+    Modules for optional features are only imported when the feature is
+    enabled, so startup doesn't pay for what isn't used. Anything that reads
+    from disk is left to `bootstrap`.
+    """
+    def __init__(self, logger, state_path=None, ootr_api_key=None,
+                 preset_ttl=None, preset_snapshot=None, seed_pool=(),
+                 seed_pool_size=None, seed_secret=None, max_rooms=None,
+                 versions_url=None, versions_cache=None, schedule_path=None,
+                 record_dir=None, metrics_host='127.0.0.1', metrics_port=None,
+                 admin_port=None, admin_socket=None):
+        self.logger = logger
+        # Most race rooms to handle at once, across all categories.
+        self.max_rooms = max_rooms
+        # Secret DWR seeds are derived from, if any (see seeds.derive_seed).
+        self.seed_secret = seed_secret
+        # Seeds to roll automatically in matching race rooms.
+        self.schedule = None
+        if schedule_path:
+            from .schedule import Schedule
+            self.schedule = Schedule(schedule_path)
+        # Where to record race room traffic for `randobot replay`, if at all.
+        self.recorder = None
+        if record_dir:
+            from .recorder import Recorder
+            self.recorder = Recorder(record_dir)
+        self.bots = []
+        # Local admin API over every bot's rooms, if enabled.
+        self.admin = None
+        if admin_port or admin_socket:
+            from .admin import AdminServer
+            self.admin = AdminServer(self, port=admin_port, path=admin_socket)
+        self.metrics = Metrics()
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.metrics.gauge(
+            'randobot_active_handlers',
+            'Race rooms currently being handled.',
+            lambda: {
+                (bot.category_slug,): len(bot.handlers)
+                for bot in self.bots
+            },
+            labels=('category',),
+        )
+
+        self.watchdog = Watchdog(self.logger, metrics=self.metrics)
+        self.metrics.gauge(
+            'randobot_load_level',
+            'Current load level (0 normal, 1 elevated, 2 critical).',
+            lambda: int(self.watchdog.level),
+        )
+
+        self.catalog = VersionCatalog(
+            source=versions_url,
+            logger=self.logger,
+        )
+        # The snapshot is loaded by bootstrap.
+        self.catalog.snapshot_path = versions_cache
+
+        self.store = None
+        if state_path:
+            from .store import StateStore
+            self.store = StateStore(state_path)
+        # Everything stored is read once by bootstrap, then split up between
+        # categories.
+        self.restored_state = {}
+
+        self.zsr = None
+        self.seed_pool = None
+        if ootr_api_key:
+            from .zsr import ZSR
+            self.zsr = ZSR(
+                ootr_api_key,
+                preset_ttl=preset_ttl,
+                preset_snapshot=preset_snapshot,
+                metrics=self.metrics,
+            )
+        if self.zsr and seed_pool:
+            from .pool import SeedPool
+            # seed_pool is a list of (preset, encrypt) pairs to keep seeds
+            # ready for.
+            self.seed_pool = SeedPool(
+                self.zsr,
+                self.logger,
+                targets=seed_pool,
+                size=seed_pool_size,
+                watchdog=self.watchdog,
+            )
+        if self.seed_pool:
+            self.metrics.counter(
+                'randobot_seed_pool_hits_total',
+                'Seeds handed out from the pre-rolled seed pool.',
+                lambda: self.seed_pool.hits,
+            )
+            self.metrics.counter(
+                'randobot_seed_pool_misses_total',
+                'Seeds rolled on demand because the seed pool was empty.',
+                lambda: self.seed_pool.misses,
+            )
+
+    def register(self, bot):
+        """
+        Add a bot to the process.
+        """
+        self.bots.append(bot)
+
+    async def bootstrap(self):
+        """
+        Read stored room state and the version catalog snapshot (and the
+        OoTR preset snapshot, if any), each in a worker thread, concurrently.
+        Returns the seconds state and catalog took.
+        """
+        loop = asyncio.get_event_loop()
+
+        async def timed(func):
+            started = time.perf_counter()
+            result = await loop.run_in_executor(None, func)
+            return time.perf_counter() - started, result
+
+        (state_time, restored), (catalog_time, _), _ = await asyncio.gather(
+            timed(self.store.load_all if self.store else dict),
+            timed(self.catalog.load_snapshot),
+            timed(self.zsr.presets.load_snapshot if self.zsr else dict),
+        )
+        self.restored_state = restored
+        return {'state': state_time, 'catalog': catalog_time}
+
+    def restored_for(self, bot):
+        """
+        Return the stored state of a bot's category's race rooms.
+        """
+        prefix = bot.category_slug + '/'
+        return {
+            name: state
+            for name, state in self.restored_state.items()
+            if name.startswith(prefix)
+        }
+
+    def at_capacity(self):
+        """
+        Return True if the process is already handling max_rooms rooms.
+        """
+        return self.max_rooms is not None and sum(
+            len(bot.handlers) for bot in self.bots
+        ) >= self.max_rooms
+
+    def start(self, loop):
+        """
+        Start shared background tasks.
+        """
+        if self.store:
+            self.store.start()
+        self.watchdog.start()
+        self.catalog.start()
+        if self.recorder:
+            self.recorder.start()
+        if self.seed_pool:
+            self.seed_pool.start()
+        if self.metrics_port:
+            loop.run_until_complete(
+                self.metrics.serve(self.metrics_host, self.metrics_port)
+            )
+        if self.admin:
+            loop.run_until_complete(self.admin.serve())
+
+    def close(self, loop):
+        """
+        Stop shared background tasks and release connections.
+        """
+        self.watchdog.close()
+        if self.recorder:
+            self.recorder.stop()
+        loop.run_until_complete(self.metrics.close())
+        if self.admin:
+            loop.run_until_complete(self.admin.close())
+        if self.zsr:
+            loop.run_until_complete(self.zsr.close())
+        if self.store:
+            self.store.close()
@@ -0,0 +1,137 @@
+import enum
+
+# The parts of a race.data payload that are kept by a handler. Everything
+# else (entrants in particular) is dropped as soon as it arrives.
+RACE_DATA_KEYS = (
+    'name', 'slug', 'status', 'goal', 'info_user', 'info_bot', 'data_url',
+    'websocket_bot_url', 'opened_at',
+)
+
+
+def trim_race_data(data):
+    """
+    Return a copy of a race data payload holding only RACE_DATA_KEYS.
+    """
+    if not data:
+        return {}
+    return {key: data[key] for key in RACE_DATA_KEYS if key in data}
+
+
+class Goal(enum.Enum):
+    """
+    Race goal, as far as the bot cares. Any goal other than the two standard
+    ones is CUSTOM.
+    """
+    STANDARD_FLAGS = 'Standard Flags'
+    TOURNAMENT = 'Tournament'
+    CUSTOM = 'custom'
+
+    @classmethod
+    def _missing_(cls, value):
+        return cls.CUSTOM
+
+    @property
+    def is_standard(self):
+        return self is not Goal.CUSTOM
+
+
+class Status(enum.Enum):
+    """
+    Race status, from racetime.gg's status values.
+    """
+    OPEN = 'open'
+    INVITATIONAL = 'invitational'
+    PENDING = 'pending'
+    IN_PROGRESS = 'in_progress'
+    FINISHED = 'finished'
+    CANCELLED = 'cancelled'
+    UNKNOWN = 'unknown'
+
+    @classmethod
+    def _missing_(cls, value):
+        return cls.UNKNOWN
+
+    @property
+    def in_progress(self):
+        return self in (Status.PENDING, Status.IN_PROGRESS)
+
+    @property
+    def is_over(self):
+        return self in (Status.FINISHED, Status.CANCELLED)
+
+
+class RoomState:
+    """
+    State of a single race room, kept across handler reconnects (and, with a
+    state store, across restarts).
+
+    Goal and status are derived from race data by `update_race` whenever
+    new race data arrives, and are not persisted. Everything else is
+    persisted by `to_dict`.
+    """
+    __slots__ = (
+        'locked', 'seed_rolled', 'build_type', 'race_version',
+        'race_flagstring', 'race_seed', 'race_url', 'reroll', 'intro_sent',
+        'schedule_checked', 'scheduled_roll', 'goal', 'goal_name', 'status',
+    )
+
+    # Slots written by to_dict, with their defaults.
+    persisted = {
+        'locked': False,
+        'seed_rolled': False,
+        'build_type': 'release',
+        'race_version': '',
+        'race_flagstring': '',
+        'race_seed': 0,
+        'race_url': '',
+        'reroll': 0,
+        'intro_sent': False,
+        # Whether the room has been checked against the schedule, and the
+        # pending scheduled roll, if any (see schedule.Schedule.plan).
+        'schedule_checked': False,
+        'scheduled_roll': None,
+    }
+
+    def __init__(self, **kwargs):
+        for name, default in self.persisted.items():
+            setattr(self, name, kwargs.get(name, default))
+        self.goal = Goal.CUSTOM
+        self.goal_name = None
+        self.status = Status.UNKNOWN
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a RoomState from a dict written by `to_dict`. Unknown keys are
+        ignored.
+        """
+        return cls(**{
+            name: value for name, value in data.items() if name in cls.persisted
+        })
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.persisted}
+
+    def update_race(self, data):
+        """
+        Update goal and status from a race data payload.
+        """
+        goal_name = (data.get('goal') or {}).get('name')
+        if goal_name != self.goal_name:
+            self.goal_name = goal_name
+            self.goal = Goal(goal_name)
+        self.status = Status((data.get('status') or {}).get('value'))
+
+    def clear(self):
+        """
+        Forget the rolled seed, flags, version and build type.
+        """
+        self.seed_rolled = False
+        self.race_flagstring = ''
+        self.race_seed = 0
+        self.race_url = ''
+        self.race_version = ''
+        self.build_type = 'release'
+
+    def __repr__(self):
+        return '<RoomState %r>' % self.to_dict()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+
+
+class StateStore:
+    """
+    Crash-safe store for race room state, keyed by race name (slug).
+
+    State lives in an SQLite database in WAL mode. Handlers call `save` after
+    changing a room's state, which only records a snapshot in memory; a
+    background task writes everything saved since the last flush in a single
+    transaction every `flush_every` seconds, so many rooms changing at once
+    cost one write (and at most one fsync).
+
+    `load_all` reads every stored room in one query, so state can be
+    restored in bulk before any handler reconnects.
+    """
+    flush_every = 0.5
+
+    # Rooms not updated for this many seconds are discarded on load.
+    max_age = 2 * 24 * 60 * 60
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS rooms ('
+            'name TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)'
+        )
+        self.pending = {}
+        self._lock = threading.Lock()
+        self._task = None
+
+    def load_all(self):
+        """
+        Return a dict of race name to state dict for every stored room.
+        """
+        with self._lock:
+            self.conn.execute(
+                'DELETE FROM rooms WHERE updated < ?',
+                (time.time() - self.max_age,),
+            )
+            return {
+                name: json.loads(state)
+                for name, state in self.conn.execute('SELECT name, state FROM rooms')
+            }
+
+    def load(self, name):
+        """
+        Return the latest state dict saved for a room (by this process, or
+        in the database), or None if there is none.
+        """
+        if name in self.pending:
+            state = self.pending[name]
+        else:
+            with self._lock:
+                row = self.conn.execute(
+                    'SELECT state FROM rooms WHERE name = ?', (name,),
+                ).fetchone()
+            state = row[0] if row else None
+        return json.loads(state) if state is not None else None
+
+    def save(self, name, state):
+        """
+        Record a snapshot of a room's state, to be written on the next flush.
+        """
+        self.pending[name] = json.dumps(state)
+
+    def delete(self, name):
+        """
+        Forget a room, on the next flush.
+        """
+        self.pending[name] = None
+
+    def write(self, batch):
+        """
+        Write a batch of snapshots in a single transaction.
+        """
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO rooms (name, state, updated) VALUES (?, ?, ?)',
+                [(name, state, now) for name, state in batch.items() if state is not None],
+            )
+            self.conn.executemany(
+                'DELETE FROM rooms WHERE name = ?',
+                [(name,) for name, state in batch.items() if state is None],
+            )
+
+    def flush(self):
+        """
+        Synchronously write everything saved so far.
+        """
+        batch, self.pending = self.pending, {}
+        if batch:
+            self.write(batch)
+
+    async def run(self):
+        """
+        Flush saved state to disk in the background, forever.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.flush_every)
+            batch, self.pending = self.pending, {}
+            if batch:
+                await loop.run_in_executor(None, self.write, batch)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    def close(self):
+        """
+        Stop flushing in the background, write anything outstanding and close
+        the database.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush()
+        self.conn.close()
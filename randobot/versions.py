@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(__file__), 'versions.json')
+
+# Aliases every catalog must define (see VersionCatalog.latest).
+REQUIRED_ALIASES = ('latest', 'latest-beta', 'latest-juef')
+
+
+class Build:
+    """
+    A known randomizer build.
+
+    Attributes:
+    * version - Version string, as shown in race info (e.g. "v3.0.3").
+    * build_type - "release", "beta" or "juef".
+    * url - Template for the URL to generate a seed with this build, or None
+      if there is no web build. May use {flags}, {seed}, {version} and {tag}
+      (the version without any "juef-" style prefix).
+    """
+    __slots__ = ('version', 'build_type', 'url')
+
+    def __init__(self, version, build_type, url=None):
+        self.version = version
+        self.build_type = build_type
+        self.url = url
+
+    def seed_url(self, flags, seed):
+        if not self.url:
+            return None
+        return self.url.format(
+            flags=flags,
+            seed=seed,
+            version=self.version,
+            tag=self.version.split('-')[-1],
+        )
+
+
+class VersionCatalog:
+    """
+    Catalog of known randomizer builds, used to validate !version and !beta
+    and to build seed URLs.
+
+    The catalog ships with the bot (versions.json) and can be kept up to date
+    from a `source` URL serving a file in the same format. It is revalidated
+    every `ttl` seconds with ETag/If-Modified-Since, and the last good copy
+    is kept on disk (if a snapshot path is given), so a restart while the
+    source is unreachable still has the latest builds.
+
+    Lookups are dict accesses on a compiled index; refreshing swaps the index
+    in one go.
+    """
+    ttl = 6 * 60 * 60
+    timeout = 10
+
+    def __init__(self, source=None, snapshot_path=None, ttl=None, logger=None):
+        self.source = source
+        self.snapshot_path = snapshot_path
+        if ttl is not None:
+            self.ttl = ttl
+        self.logger = logger
+        self.etag = None
+        self.last_modified = None
+        self._task = None
+        with open(DEFAULT_CATALOG_PATH, 'r', encoding='utf-8') as f:
+            self.data = json.load(f)
+        self.builds, self.aliases, self.templates = self.compile(self.data)
+        self.load_snapshot()
+
+    @staticmethod
+    def compile(data):
+        """
+        Compile raw catalog data into a dict of lowercased version (or
+        alias) to Build, a dict of alias to version and a dict of build type
+        to URL template.
+        """
+        if not isinstance(data, dict) or not isinstance(data.get('builds'), list):
+            raise ValueError('Version catalog must be a JSON object with a list of builds.')
+        templates = {
+            build_type: (definition or {}).get('url')
+            for build_type, definition in (data.get('build_types') or {}).items()
+        }
+        builds = {}
+        for definition in data['builds']:
+            build_type = definition.get('build_type', 'release')
+            if build_type not in templates:
+                raise ValueError(
+                    'Build "%(version)s" has unknown build type "%(type)s".'
+                    % {'version': definition.get('version'), 'type': build_type}
+                )
+            build = Build(
+                definition['version'],
+                build_type,
+                definition.get('url', templates[build_type]),
+            )
+            builds[build.version.lower()] = build
+            if build_type == 'beta':
+                # Also accept "v3.0.4b701", as older !beta commands wrote it.
+                builds[build.version.lower().replace('-b', 'b')] = build
+        aliases = {}
+        for alias, version in (data.get('aliases') or {}).items():
+            if version.lower() not in builds:
+                raise ValueError(
+                    'Alias "%(alias)s" points to unknown version "%(version)s".'
+                    % {'alias': alias, 'version': version}
+                )
+            aliases[alias.lower()] = version
+            builds[alias.lower()] = builds[version.lower()]
+        for alias in REQUIRED_ALIASES:
+            if alias not in aliases:
+                raise ValueError('Version catalog has no "%s" alias.' % alias)
+        return builds, aliases, templates
+
+    def resolve(self, name):
+        """
+        Return the Build for a version or alias (e.g. "latest"), or None.
+        """
+        if not name:
+            return None
+        return self.builds.get(name.lower())
+
+    def beta(self, version, build_number):
+        """
+        Return the beta Build for a base version and build number, or None.
+        """
+        build = self.resolve('%s-b%s' % (version, build_number))
+        if build and build.build_type == 'beta':
+            return build
+        return None
+
+    def latest(self, build_type='release'):
+        """
+        Return the latest version of a build type ("release", "beta" or
+        "juef").
+        """
+        alias = 'latest' if build_type == 'release' else 'latest-' + build_type
+        return self.aliases[alias]
+
+    def seed_url(self, version, build_type, flags, seed):
+        """
+        Return the URL to generate a seed in the web randomizer, or None if
+        there is no web build for the version.
+        """
+        build = self.resolve(version)
+        if build and build.build_type == build_type:
+            return build.seed_url(flags, seed)
+        # Not in the catalog (e.g. a room restored from before it was
+        # updated): use the build type's URL template.
+        return Build(version, build_type, self.templates.get(build_type)).seed_url(flags, seed)
+
+    def load_snapshot(self):
+        """
+        Load the last good catalog from disk, if there is one.
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.builds, self.aliases, self.templates = self.compile(snapshot['catalog'])
+        except (OSError, ValueError, KeyError, TypeError):
+            if self.logger:
+                self.logger.error(
+                    'Ignoring invalid version catalog snapshot %(path)s'
+                    % {'path': self.snapshot_path},
+                    exc_info=True,
+                )
+            return
+        self.data = snapshot['catalog']
+        self.etag = snapshot.get('etag')
+        self.last_modified = snapshot.get('last_modified')
+
+    def save_snapshot(self):
+        """
+        Atomically write the current catalog to disk.
+        """
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'catalog': self.data,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+            }, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    async def refresh(self):
+        """
+        Fetch the catalog from the source, sending validators from the
+        current copy. An invalid catalog is rejected and the current one
+        kept.
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        async with aiohttp.request(
+            'GET',
+            self.source,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        ) as resp:
+            if resp.status == 304:
+                return
+            resp.raise_for_status()
+            data = json.loads(await resp.read())
+            compiled = self.compile(data)
+            etag = resp.headers.get('ETag')
+            last_modified = resp.headers.get('Last-Modified')
+        self.data = data
+        self.builds, self.aliases, self.templates = compiled
+        self.etag, self.last_modified = etag, last_modified
+        if self.logger:
+            self.logger.info(
+                'Loaded %(count)d builds from %(source)s'
+                % {'count': len(data['builds']), 'source': self.source}
+            )
+        if self.snapshot_path:
+            await asyncio.get_event_loop().run_in_executor(None, self.save_snapshot)
+
+    async def run(self):
+        """
+        Refresh the catalog every `ttl` seconds, forever.
+        """
+        while True:
+            try:
+                await self.refresh()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError, TypeError):
+                if self.logger:
+                    self.logger.error(
+                        'Unable to refresh versions from %(source)s, keeping the old ones.'
+                        % {'source': self.source},
+                        exc_info=True,
+                    )
+            await asyncio.sleep(self.ttl)
+
+    def start(self):
+        """
+        Start refreshing in the background, if there is a source.
+        """
+        if self.source and self._task is None:
+            self._task = asyncio.ensure_future(self.run())
@@ -0,0 +1,106 @@
+import asyncio
+import enum
+import time
+
+
+class Load(enum.IntEnum):
+    """
+    Degradation levels, from least to most loaded.
+
+    * NORMAL - Everything runs as usual.
+    * ELEVATED - Non-essential chat messages (intros, the chat copy of race
+      info) are held back until load drops, so replies to commands go first.
+    * CRITICAL - Non-essential messages are dropped, read-only commands are
+      ignored and seed pool refills are paused.
+    """
+    NORMAL = 0
+    ELEVATED = 1
+    CRITICAL = 2
+
+
+class Watchdog:
+    """
+    Measures event loop lag continuously and sets the process-wide load
+    level from it.
+
+    Lag is sampled every `interval` seconds and smoothed. The level rises as
+    soon as the smoothed lag crosses a level's threshold, and only falls once
+    the lag has stayed below `recover_ratio` of the current level's threshold
+    for `recover_after` seconds, so it doesn't flap.
+    """
+    interval = 0.25
+    smoothing = 0.3
+    thresholds = {
+        Load.ELEVATED: 0.1,
+        Load.CRITICAL: 0.5,
+    }
+    recover_ratio = 0.5
+    recover_after = 5
+
+    def __init__(self, logger, metrics=None):
+        self.logger = logger
+        self.metrics = metrics
+        self.level = Load.NORMAL
+        self.lag = 0.0
+        self.changes = 0
+        self.normal = asyncio.Event()
+        self.normal.set()
+        self._calm_since = None
+        self._task = None
+
+    def observe(self, lag):
+        """
+        Record a lag sample and update the load level.
+        """
+        self.lag += self.smoothing * (lag - self.lag)
+        if self.metrics:
+            self.metrics.loop_lag.set(lag)
+            self.metrics.loop_lag_histogram.observe(lag)
+
+        level = Load.NORMAL
+        for candidate, threshold in self.thresholds.items():
+            if self.lag >= threshold:
+                level = max(level, candidate)
+        if level > self.level:
+            self._calm_since = None
+            self.set_level(level)
+        elif level < self.level:
+            threshold = self.thresholds[self.level] * self.recover_ratio
+            now = time.monotonic()
+            if self.lag >= threshold:
+                self._calm_since = None
+            elif self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.recover_after:
+                self._calm_since = None
+                self.set_level(level)
+
+    def set_level(self, level):
+        self.logger.warning(
+            'Event loop lag %(lag).3fs, load level %(old)s -> %(new)s'
+            % {'lag': self.lag, 'old': self.level.name, 'new': level.name}
+        )
+        self.level = level
+        self.changes += 1
+        if level == Load.NORMAL:
+            self.normal.set()
+        else:
+            self.normal.clear()
+
+    async def run(self):
+        """
+        Measure how late the event loop wakes us up, forever.
+        """
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.observe(max(0.0, time.monotonic() - started - self.interval))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
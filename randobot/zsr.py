@@ -1,38 +1,309 @@
+import asyncio
 import json
+import os
+import random
+import time
 
-import requests
+import aiohttp
+
+
+class ZSRError(Exception):
+    """
+    Raised when ootrandomizer.com or zeldaspeedruns.com cannot satisfy a
+    request, even after retrying.
+    """
 
 
 class ZSR:
     """
     Class for interacting with ootrandomizer.com to generate seeds, and
     zeldaspeedruns.com to get available presets.
+
+    One instance holds a single pooled, keep-alive HTTP session and is meant
+    to be shared by every race handler in the process. All calls are
+    coroutines, so a slow upstream only delays the room that asked.
     """
     seed_public = 'https://ootrandomizer.com/seed/get?id=%(seedID)s'
     seed_endpoint = 'https://ootrandomizer.com/api/seed/preset'
     preset_endpoint = 'https://www.zeldaspeedruns.com/assets/ootr_presets.json'
 
-    def __init__(self, ootr_api_key):
+    # Total time allowed per attempt, in seconds. Seed generation is slow.
+    preset_timeout = 10
+    seed_timeout = 60
+
+    # Upper bound on simultaneous requests to the upstream APIs.
+    max_concurrency = 4
+
+    # Failed attempts are retried with exponential backoff (plus jitter).
+    # Requests that aren't idempotent (seed generation) are only retried when
+    # they can't have been acted on: if no connection could be made, or the
+    # server turned them away with a 429.
+    max_retries = 3
+    retry_backoff = 1.0
+    retry_statuses = (429, 500, 502, 503, 504)
+    idempotent_methods = ('GET', 'HEAD')
+
+    def __init__(self, ootr_api_key, max_concurrency=None, preset_ttl=None,
+                 preset_snapshot=None, metrics=None):
         self.ootr_api_key = ootr_api_key
+        self.metrics = metrics
+        if max_concurrency is not None:
+            self.max_concurrency = max_concurrency
+        self.presets = PresetCache(self, ttl=preset_ttl, snapshot_path=preset_snapshot)
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        """
+        Return the shared HTTP session, creating it on first use so that it
+        binds to the running event loop.
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    keepalive_timeout=60,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """
+        Close the shared HTTP session.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _request(self, method, url, timeout, endpoint, **kwargs):
+        """
+        Perform a HTTP request and return a (status, headers, body) tuple,
+        retrying on connection errors, timeouts and transient server errors
+        (see `idempotent_methods`).
+
+        `endpoint` is a short name for the API being called, used in metrics.
+        """
+        started = time.perf_counter()
+        try:
+            return await self._request_with_retries(method, url, timeout, **kwargs)
+        except ZSRError:
+            if self.metrics:
+                self.metrics.zsr_errors.inc(endpoint=endpoint)
+            raise
+        finally:
+            if self.metrics:
+                self.metrics.zsr_duration.observe(
+                    time.perf_counter() - started,
+                    endpoint=endpoint,
+                )
 
-    def load_presets(self):
+    async def _request_with_retries(self, method, url, timeout, **kwargs):
+        session = self._get_session()
+        idempotent = method in self.idempotent_methods
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(
+                    self.retry_backoff * 2 ** (attempt - 1) * (1 + random.random())
+                )
+            try:
+                async with self._semaphore:
+                    async with session.request(
+                        method,
+                        url,
+                        timeout=aiohttp.ClientTimeout(total=timeout),
+                        **kwargs
+                    ) as resp:
+                        if resp.status in self.retry_statuses:
+                            last_error = ZSRError('%s returned HTTP %d' % (url, resp.status))
+                            if idempotent or resp.status == 429:
+                                continue
+                            raise last_error
+                        resp.raise_for_status()
+                        return resp.status, resp.headers, await resp.read()
+            except aiohttp.ClientResponseError as e:
+                raise ZSRError('%s returned HTTP %d' % (url, e.status)) from e
+            except aiohttp.ClientConnectorError as e:
+                # Never got as far as sending the request.
+                last_error = ZSRError('%s failed: %r' % (url, e))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = ZSRError('%s failed: %r' % (url, e))
+                if not idempotent:
+                    raise last_error from e
+        raise last_error
+
+    async def load_presets(self):
+        """
+        Return available seed presets, as a dict of preset name to full name.
+
+        Served from the process-wide preset cache.
         """
-        Load and return available seed presets.
+        return await self.presets.get()
+
+    async def fetch_presets(self, etag=None, last_modified=None):
+        """
+        Download the preset catalog, revalidating against the given validators.
+
+        Returns a (presets, etag, last_modified) tuple, where presets is None
+        if the server says the catalog has not changed.
         """
-        resp = requests.get(self.preset_endpoint)
-        data = json.loads(resp.content)
-        return {
-            key: value['fullName']
-            for key, value in data.items()
-        }
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        status, resp_headers, content = await self._request(
+            'GET',
+            self.preset_endpoint,
+            timeout=self.preset_timeout,
+            endpoint='presets',
+            headers=headers,
+        )
+        etag = resp_headers.get('ETag', etag)
+        last_modified = resp_headers.get('Last-Modified', last_modified)
+        if status == 304:
+            return None, etag, last_modified
+        try:
+            presets = {
+                key: value['fullName']
+                for key, value in json.loads(content).items()
+            }
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            if self.metrics:
+                self.metrics.zsr_errors.inc(endpoint='presets')
+            raise ZSRError('%s returned an invalid preset list: %r' % (self.preset_endpoint, e)) from e
+        return presets, etag, last_modified
 
-    def roll_seed(self, preset, encrypt):
+    async def roll_seed(self, preset, encrypt):
         """
         Generate a seed and return its public URL.
         """
-        resp = requests.post(self.seed_endpoint, preset, params={
-            'key': self.ootr_api_key,
-            'encrypt': 'true' if encrypt else 'false',
-        }, headers={'Content-Type': 'text/plain'})
-        data = json.loads(resp.content)
-        return self.seed_public % data
+        _, _, content = await self._request(
+            'POST',
+            self.seed_endpoint,
+            timeout=self.seed_timeout,
+            endpoint='seed',
+            data=preset,
+            params={
+                'key': self.ootr_api_key,
+                'encrypt': 'true' if encrypt else 'false',
+            },
+            headers={'Content-Type': 'text/plain'},
+        )
+        try:
+            return self.seed_public % json.loads(content)
+        except (ValueError, KeyError, TypeError) as e:
+            if self.metrics:
+                self.metrics.zsr_errors.inc(endpoint='seed')
+            raise ZSRError('%s returned an invalid seed: %r' % (self.seed_endpoint, e)) from e
+
+
+class PresetCache:
+    """
+    Process-wide cache of the zeldaspeedruns.com preset catalog.
+
+    Entries are fresh for `ttl` seconds. After that the stale catalog is still
+    served while a single background task revalidates it with ETag and
+    If-Modified-Since, so callers never wait on the network once something
+    has been loaded. The last good catalog is also kept on disk (if a
+    snapshot path is given), so a cold start or upstream outage can serve
+    presets straight away.
+    """
+    ttl = 3600
+
+    def __init__(self, zsr, ttl=None, snapshot_path=None):
+        self.zsr = zsr
+        if ttl is not None:
+            self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.presets = None
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = None
+        self._refresh_task = None
+
+    def is_fresh(self):
+        return (
+            self.fetched_at is not None
+            and time.monotonic() - self.fetched_at < self.ttl
+        )
+
+    async def get(self):
+        """
+        Return the preset catalog, loading or revalidating it as needed.
+        """
+        if self.presets is None:
+            # Nothing to serve yet, so the caller has to wait (sharing the
+            # one in-flight download with anyone else who is waiting).
+            await asyncio.shield(self.refresh_in_background())
+        elif not self.is_fresh():
+            self.refresh_in_background()
+        return self.presets
+
+    def refresh_in_background(self):
+        """
+        Start a revalidation task, unless one is already running, and return
+        it.
+        """
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self.refresh())
+            self._refresh_task.add_done_callback(self._refresh_done)
+        return self._refresh_task
+
+    def _refresh_done(self, task):
+        # On failure keep serving the stale catalog; the next get() will try
+        # again.
+        if not task.cancelled():
+            task.exception()
+
+    async def refresh(self):
+        """
+        Fetch the catalog, sending validators from the current copy.
+        """
+        presets, self.etag, self.last_modified = await self.zsr.fetch_presets(
+            etag=self.etag if self.presets is not None else None,
+            last_modified=self.last_modified if self.presets is not None else None,
+        )
+        self.fetched_at = time.monotonic()
+        if presets is not None:
+            self.presets = presets
+            if self.snapshot_path:
+                await asyncio.get_event_loop().run_in_executor(
+                    None, self.save_snapshot,
+                )
+
+    def load_snapshot(self):
+        """
+        Load the last good catalog from disk. The snapshot is always treated
+        as stale, so it will be revalidated on first use.
+
+        This blocks, so is run in a worker thread at startup (see
+        SharedResources.bootstrap).
+        """
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or not isinstance(data.get('presets'), dict):
+            return
+        self.presets = data['presets'] or None
+        self.etag = data.get('etag')
+        self.last_modified = data.get('last_modified')
+        self.fetched_at = None
+
+    def save_snapshot(self):
+        """
+        Atomically write the current catalog to disk.
+        """
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'presets': self.presets,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+            }, f)
+        os.replace(tmp_path, self.snapshot_path)
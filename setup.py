@@ -19,10 +19,14 @@ setup(
     },
     version='1.0.0',
     install_requires=[
+        'aiohttp>=3.7',
         'racetime_bot>=1.5.0,<2.0',
         'websockets<14'
     ],
     packages=find_packages(),
+    package_data={
+        'randobot': ['*.json'],
+    },
     entry_points={
         'console_scripts': [
             'randobot=randobot:main',